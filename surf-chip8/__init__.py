@@ -1,8 +1,11 @@
-from flask import Flask, render_template, g, send_from_directory
+from flask import Flask, render_template, g
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'secret_key'
+    # FLASK_DATABASE_URL=postgresql://... and friends override the defaults
+    app.config.from_prefixed_env()
+    app.config.update(config or {})
     
     @app.route('/')
     def index():
@@ -10,17 +13,24 @@ def create_app():
 
     @app.route('/chip8/<path:path>')
     def get_chip_file(path):
-        return send_from_directory('static/chip8', path)
+        return assets.send_asset(path)
 
     @app.route('/about')
     def about():
         return render_template("about.html")
     
+    from . import assets
+    assets.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
     from . import db
     db.init_app(app)
 
     from . import auth
     from . import snippets
+    auth.init_app(app)
     app.register_blueprint(auth.bp)
     app.register_blueprint(snippets.bp)
     return app
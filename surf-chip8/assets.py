@@ -0,0 +1,145 @@
+from flask import current_app
+from flask import request
+from flask import send_file
+from flask import send_from_directory
+from flask.cli import with_appcontext
+import click
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Emulator assets are copied under content-hash names with gzip and brotli
+# variants next to them. manifest.json maps every original name to its
+# build, url_for('get_chip_file', path=NAME) links the current build, and
+# builds are served as immutable since their URL changes with the content.
+
+SOURCE = os.path.join('static', 'chip8')
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+mimetypes.add_type('application/wasm', '.wasm')
+
+def compressors():
+    yield 'gzip', '.gz', lambda data: gzip.compress(data, 9, mtime=0)
+    if brotli is not None:
+        yield 'br', '.br', lambda data: brotli.compress(data, quality=11)
+
+def fingerprint(name, digest):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest[:12]}{ext}"
+
+def write(target, name, data):
+    path = os.path.join(target, name)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path) # Other workers may be building at the same time
+
+def load_manifest(target):
+    try:
+        with open(os.path.join(target, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+def build(source, target, force=False):
+    os.makedirs(target, exist_ok=True)
+    previous = dict() if force else load_manifest(target)
+    manifest = dict()
+
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        if not os.path.isfile(path): continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+
+        entry = previous.get(name)
+        files = [entry['file'], *entry['encodings'].values()] if entry else []
+        if entry and entry['etag'] == digest and all(os.path.exists(os.path.join(target, f)) for f in files):
+            manifest[name] = entry
+            continue
+
+        entry = manifest[name] = dict(file=fingerprint(name, digest), etag=digest, encodings=dict())
+        write(target, entry['file'], data)
+        for encoding, suffix, compress in compressors():
+            packed = compress(data)
+            if len(packed) < len(data):
+                entry['encodings'][encoding] = entry['file'] + suffix
+                write(target, entry['file'] + suffix, packed)
+
+    write(target, MANIFEST, json.dumps(manifest, indent=1).encode('utf-8'))
+
+    # Builds of older contents are dropped, pages are rendered with new URLs
+    keep = {MANIFEST} | {f for entry in manifest.values() for f in [entry['file'], *entry['encodings'].values()]}
+    for name in os.listdir(target):
+        if name not in keep and not name.endswith('.tmp'):
+            os.remove(os.path.join(target, name))
+    return manifest
+
+def use_manifest(app, manifest):
+    # Original name -> entry for url_for, built name -> (name, entry) to serve
+    app.extensions['assets'] = (manifest, {entry['file']: (name, entry) for name, entry in manifest.items()})
+
+def versioned_url(endpoint, values):
+    if endpoint == 'get_chip_file':
+        entry = current_app.extensions['assets'][0].get(values.get('path'))
+        if entry: values['path'] = entry['file']
+
+def select_encoding(entry):
+    for encoding in ('br', 'gzip'):
+        if encoding in entry['encodings'] and request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+def send_asset(path):
+    built = current_app.extensions['assets'][1].get(path)
+    if built is None:
+        # Unversioned name, served as before
+        return send_from_directory(SOURCE, path)
+
+    name, entry = built
+    encoding = select_encoding(entry)
+    file = entry['encodings'][encoding] if encoding else entry['file']
+    # One strong validator per representation, the bytes differ per encoding
+    etag = f"{entry['etag'][:32]}-{encoding or 'identity'}"
+
+    response = send_file(os.path.join(current_app.config['ASSETS_DIR'], file),
+        mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+        etag=etag, conditional=True)
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    if encoding and response.status_code != 304:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@click.command('build-assets')
+@click.option('--force', is_flag=True, help='Rebuild unchanged assets too.')
+@with_appcontext
+def build_assets_command(force):
+    source = os.path.join(current_app.root_path, SOURCE)
+    manifest = build(source, current_app.config['ASSETS_DIR'], force=force)
+    use_manifest(current_app, manifest)
+    for name, entry in manifest.items():
+        variants = ', '.join(entry['encodings']) or 'identity only'
+        click.echo(f"{name} -> {entry['file']} ({variants})")
+
+def init_app(app):
+    app.config.setdefault('ASSETS_DIR', os.path.join(app.instance_path, 'assets'))
+    app.config.setdefault('ASSETS_BUILD_ON_STARTUP', True)
+
+    if app.config['ASSETS_BUILD_ON_STARTUP']:
+        manifest = build(os.path.join(app.root_path, SOURCE), app.config['ASSETS_DIR'])
+    else:
+        manifest = load_manifest(app.config['ASSETS_DIR'])
+    use_manifest(app, manifest)
+
+    app.url_defaults(versioned_url)
+    app.cli.add_command(build_assets_command)
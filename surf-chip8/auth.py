@@ -1,21 +1,35 @@
 from flask import Blueprint
 from flask import flash
+from flask import current_app
 from flask import g
+from flask import has_request_context
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask import session
 from flask import url_for
 
+from flask.ctx import _AppCtxGlobals
+from sqlalchemy import event
 from sqlalchemy import select
 
 from .db import get_db_session
 from .model import *
+from . import passwords
 
+from collections import OrderedDict
+from dataclasses import dataclass
+import click
 import functools
+import os
+import tempfile
+import threading
+import time
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+BUSY_MESSAGE = 'Сервер перегружен, попробуйте еще раз через минуту'
+
 @bp.route('/sign-up', methods=('GET', 'POST'))
 def sign_up():
     if request.method == 'POST':
@@ -34,7 +48,11 @@ def sign_up():
             error = 'Введенные пароли не совпадают'
 
         if error is None:
-            user = User(username, password)
+            try:
+                user = User(username, passwords.hash_password(password))
+            except passwords.HashingBusy:
+                flash(BUSY_MESSAGE)
+                return render_template('auth/sign-up.html'), 503
             
             try:
                 dbs.add(user)
@@ -64,21 +82,92 @@ def sign_in():
         except:
             user = None
         
-        if (user is None) or (not user.check_password(password)):
+        password_hash = user.password if user else None
+        # Hashing takes a while, no pooled connection is held meanwhile
+        dbs.rollback()
+
+        try:
+            valid = (user is not None) and passwords.check_password(password_hash, password)
+        except passwords.HashingBusy:
+            flash(BUSY_MESSAGE)
+            return render_template('auth/sign-in.html'), 503
+
+        if not valid:
             error = 'Неверное имя или пароль'
+        elif passwords.needs_rehash(password_hash):
+            # Hash made with older settings, the password is known right now
+            try:
+                user.password = passwords.hash_password(password)
+                dbs.commit()
+            except passwords.HashingBusy:
+                pass # Upgraded on a later sign-in
 
         if error is None:
             session.clear()
             session['user_id'] = user.id
+            invalidate_user(user.id)
             return redirect(url_for('index'))
 
         flash(error)
     return render_template('auth/sign-in.html')
 
-@bp.before_app_request
+# Signed-in users are cached per process as plain snapshots, ORM objects
+# would be shared between sessions and threads. Entries expire after
+# USER_CACHE_TTL seconds and are dropped whenever a User row changes.
+USER_CACHE_LIMIT = 1024
+user_cache = OrderedDict()
+user_cache_lock = threading.Lock()
+
+@dataclass(frozen=True)
+class SignedInUser:
+    id: int
+    name: str
+
+def invalidate_user(user_id):
+    with user_cache_lock:
+        user_cache.pop(user_id, None)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, user):
+    invalidate_user(user.id)
+
 def load_signed_in_user():
-    user_id = session.get('user_id')
-    g.user = None if (user_id is None) else get_db_session().get(User, user_id)
+    user_id = session.get('user_id') if has_request_context() else None
+    if user_id is None: return None
+
+    now = time.monotonic()
+    with user_cache_lock:
+        cached = user_cache.get(user_id)
+        if cached is not None and cached[0] > now:
+            user_cache.move_to_end(user_id)
+            return cached[1]
+
+    user = get_db_session().get(User, user_id)
+    user = user and SignedInUser(user.id, user.name)
+    with user_cache_lock:
+        user_cache[user_id] = (now + current_app.config['USER_CACHE_TTL'], user)
+        while len(user_cache) > USER_CACHE_LIMIT:
+            user_cache.popitem(last=False)
+    return user
+
+# g.user is resolved on first access, requests that never read it (assets,
+# JSON endpoints of anonymous clients) do not touch the database
+class AppGlobals(_AppCtxGlobals):
+    @property
+    def user(self):
+        if '_user' not in self.__dict__:
+            self._user = load_signed_in_user()
+        return self._user
+
+    @user.setter
+    def user(self, value):
+        self._user = value
+
+def init_app(app):
+    passwords.init_app(app)
+    app.config.setdefault('USER_CACHE_TTL', 60)
+    app.app_ctx_globals_class = AppGlobals
 
 @bp.route('/logout')
 def logout():
@@ -93,3 +182,69 @@ def login_required(view):
             return redirect(url_for('auth.sign_in'))
         return view(*args, **kwargs)
     return wrapped_view
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float('nan')
+
+def bench_sign_in(config, clients, seconds):
+    from . import create_app
+    app = create_app(config)
+    with app.app_context():
+        from .db import init_db
+        init_db()
+        dbs = get_db_session()
+        dbs.add(User('bench', passwords.hash_password('password')))
+        dbs.commit()
+
+    counts = {200: 0, 302: 0, 503: 0}
+    sign_ins = list()
+    latencies = list()
+    stop = time.monotonic() + seconds
+
+    def sign_in_loop():
+        client = app.test_client()
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            status = client.post('/auth/sign-in', data={'username': 'bench', 'password': 'password'}).status_code
+            counts[status] = counts.get(status, 0) + 1
+            if status == 302: sign_ins.append(time.perf_counter() - start)
+            if status == 503: time.sleep(0.1) # Refused clients retry a bit later
+
+    # Cheap page requested next to the sign-ins, shows how starved it gets
+    def probe_loop():
+        client = app.test_client()
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            client.get('/about')
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=sign_in_loop) for _ in range(clients)]
+    threads.append(threading.Thread(target=probe_loop))
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    return counts, sorted(sign_ins), sorted(latencies)
+
+@bp.cli.command('bench')
+@click.option('--clients', type=int, default=16, help='Concurrent sign-in clients.')
+@click.option('--seconds', type=float, default=5.0, help='Duration of every run.')
+@click.option('--method', default=None, help='Hash method, PASSWORD_HASH_METHOD by default.')
+def bench_sign_in_command(clients, seconds, method):
+    method = method or current_app.config['PASSWORD_HASH_METHOD']
+    click.echo(f"{clients} clients, {method}")
+    for workers in (0, current_app.config['PASSWORD_HASH_WORKERS']):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {
+                'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                'ASSETS_BUILD_ON_STARTUP': False,
+                'PASSWORD_HASH_METHOD': method,
+                'PASSWORD_HASH_WORKERS': workers,
+                'PASSWORD_HASH_QUEUE': current_app.config['PASSWORD_HASH_QUEUE'],
+            }
+            counts, sign_ins, latencies = bench_sign_in(config, clients, seconds)
+        name = f"{workers} workers" if workers else "inline"
+        click.echo(f"{name:<12} {counts[302] / seconds:6.1f} sign-ins/s, {counts[503]} refused,"
+                   f" sign-in p50 {percentile(sign_ins, 0.5):.2f}s,"
+                   f" /about p50 {percentile(latencies, 0.5) * 1000:.1f}ms p95 {percentile(latencies, 0.95) * 1000:.1f}ms")
@@ -0,0 +1,4 @@
+from .mymain import main
+import sys
+
+sys.exit(main())
@@ -2,28 +2,124 @@ from .mytoken import tokenize, TokenizeError
 from .myast import *
 from .myparser import Parser
 from .mymain import Env
+from .metrics import Counter, Histogram
+from .optimizer import optimize
+from .stream import assemble_stream
+from time import perf_counter
 import io
+import logging
 
+logger = logging.getLogger(__name__)
+
+# Bump whenever generated code or diagnostics change, stored builds are redone
+ASSEMBLER_VERSION = 4
+
+STAGE_SECONDS = Histogram('chip8asm_stage_seconds', 'Time spent in every assembler stage.', ['stage'])
+TOKENS = Counter('chip8asm_tokens_total', 'Tokens produced by the tokenizer.')
+STATEMENTS = Counter('chip8asm_statements_total', 'Statements produced by the parser.')
+OUTPUT_BYTES = Counter('chip8asm_output_bytes_total', 'Bytes of generated code.')
+ASSEMBLIES = Counter('chip8asm_assemblies_total', 'Assembled sources by result.', ['result'])
+ERRORS = Counter('chip8asm_errors_total', 'Assembly errors by stage and type.', ['stage', 'type'])
+SAVED_BYTES = Counter('chip8asm_optimizer_saved_bytes_total', 'Bytes removed by the optimizer.')
+SAVED_CYCLES = Counter('chip8asm_optimizer_saved_cycles_total', 'Instruction cycles saved by the optimizer.')
+
+# Sources are assembled in one streaming pass. The optimizer needs the whole
+# program, those go through the three pass assembler, which also stays as the
+# reference the streaming one is checked against (see bench.py).
+#
+# The streaming pass stops at the first error in source order, while the
+# three pass assembler (and the incremental one) finds tokenize errors
+# first, then parse errors, then unknown labels. A source that fails to
+# stream is assembled again by the three pass path, so every path reports
+# the same error; only failing builds pay for the second pass.
+#
+# Streamed builds are timed as stream (the whole pass), stream_parse
+# (tokenizing and parsing), stream_encode and stream_fixup; the tokenize,
+# parse, calculate, preprocess and generate stages only come from optimized
+# builds.
 def assemble(snippet):
+    if getattr(snippet, 'optimize', False):
+        return assemble_reference(snippet)
+
+    stage = 'stream'
+    try:
+        start = perf_counter()
+        result = assemble_stream(snippet.name, snippet.source)
+        STAGE_SECONDS.observe(perf_counter() - start, stage)
+        for phase, seconds in result.seconds.items():
+            STAGE_SECONDS.observe(seconds, f"{stage}_{phase}")
+    except (TokenizeError, ChipSyntaxError):
+        # Counted by the three pass path, with the stage it fails in
+        return assemble_reference(snippet)
+    except Exception as err:
+        ERRORS.inc(stage, type(err).__name__)
+        raise
+    else:
+        TOKENS.inc(amount=result.tokens)
+        STATEMENTS.inc(amount=result.statements)
+        OUTPUT_BYTES.inc(amount=len(result.code))
+        ASSEMBLIES.inc('success')
+        return True, io.BytesIO(bytes(result.code)), "Success!"
+
+def assemble_reference(snippet):
+    stage = 'tokenize'
     try:
+        start = perf_counter()
         env = Env()
         tokens = tokenize(snippet.name, snippet.source)
+        now = perf_counter()
+        STAGE_SECONDS.observe(now - start, stage)
+
+        stage, start = 'parse', now
         parser = Parser(tokens);
         ast = parser.parse()
+        now = perf_counter()
+        STAGE_SECONDS.observe(now - start, stage)
 
-        code = list()
-        
         length = len(ast)
 
-        print(*ast, sep='\n')
-        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('\n'.join(map(repr, ast)))
+
+        stage, start = 'calculate', perf_counter()
         for i in range(length): ast[i].calculate(env)
-        for i in range(length): ast[i].preprocess(env)
-        for i in range(length): code += ast[i].generate(env)
-        
-    except TokenizeError as err:
-        return False, None, str(err)
-    except ChipSyntaxError as err:
+        now = perf_counter()
+        STAGE_SECONDS.observe(now - start, stage)
+
+        savings = None
+        if getattr(snippet, 'optimize', False):
+            # Labels are still symbolic here, addresses are redone after it
+            stage, start = 'optimize', now
+            ast, savings = optimize(ast, env)
+            length = len(ast)
+            env = Env()
+            for i in range(length): ast[i].calculate(env)
+            now = perf_counter()
+            STAGE_SECONDS.observe(now - start, stage)
+
+        stage, start = 'preprocess', now
+        for i in range(length): ast[i] = ast[i].preprocess(env)
+        now = perf_counter()
+        STAGE_SECONDS.observe(now - start, stage)
+
+        stage, start = 'generate', now
+        code = generate(ast, env)
+        STAGE_SECONDS.observe(perf_counter() - start, stage)
+
+    except (TokenizeError, ChipSyntaxError) as err:
+        ERRORS.inc(stage, type(err).__name__)
+        ASSEMBLIES.inc('error')
         return False, None, str(err)
+    except Exception as err:
+        ERRORS.inc(stage, type(err).__name__)
+        raise
     else:
+        TOKENS.inc(amount=len(tokens))
+        STATEMENTS.inc(amount=length)
+        OUTPUT_BYTES.inc(amount=len(code))
+        ASSEMBLIES.inc('success')
+        if savings is not None:
+            SAVED_BYTES.inc(amount=savings.bytes)
+            SAVED_CYCLES.inc(amount=savings.cycles)
+            return True, io.BytesIO(bytes(code)), f"Success! {savings}"
         return True, io.BytesIO(bytes(code)), "Success!"
@@ -0,0 +1,82 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import multiprocessing
+import threading
+import io
+import zipfile
+
+from .assembler import assemble
+
+@dataclass
+class Source:
+    name: str
+    source: str
+    optimize: bool = False
+
+@dataclass
+class Result:
+    index: int
+    name: str
+    success: bool
+    rom: bytes
+    message: str
+
+def assemble_item(item):
+    index, name, source, *options = item
+    try:
+        success, data, message = assemble(Source(name, source, *options))
+    except Exception as err:
+        # One broken source must not take the whole batch down
+        return Result(index, name, False, None, f"{name} Internal error: {err!r}")
+    return Result(index, name, success, data.getvalue() if success else None, message)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor(jobs=None):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Workers are spawned, forking a threaded web server is unsafe
+            context = multiprocessing.get_context('spawn')
+            _executor = ProcessPoolExecutor(max_workers=jobs, mp_context=context)
+        return _executor
+
+# Assembles (name, source) or (name, source, optimize) items in worker
+# processes, results are yielded in input order as soon as they are ready
+def assemble_batch(sources, executor=None, jobs=None, chunksize=8):
+    executor = executor or get_executor(jobs)
+    items = ((index, *item) for index, item in enumerate(sources))
+    yield from executor.map(assemble_item, items, chunksize=chunksize)
+
+class ZipStream(io.RawIOBase):
+    def __init__(self):
+        self.chunks = list()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# Zip archive written on the fly: NAME.ch8 per success, NAME.txt per failure
+def zip_results(results, filename=str):
+    stream = ZipStream()
+    seen = set()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            name = filename(result.name) or 'snippet'
+            name = name if name not in seen else f"{name}-{result.index}"
+            seen.add(name)
+            if result.success:
+                archive.writestr(f"{name}.ch8", result.rom)
+            else:
+                archive.writestr(f"{name}.txt", result.message)
+            yield stream.drain()
+    yield stream.drain()
@@ -0,0 +1,393 @@
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+
+from .mytoken import tokenize, TokenizeError, Location
+from . import reference_tokenizer
+from .myparser import Parser
+from .myast import INSTRUCTION_SET, ArgType, generate
+from .mymain import Env
+from .stream import assemble_stream
+from .linker import assemble_object, link
+from .disassembler import disassemble
+from .assembler import assemble, assemble_reference
+from .batch import Source
+from .incremental import IncrementalAssembler
+
+# Synthetic sources for every assembler stage, timed one stage at a time:
+#
+#   python -m chip8asm.bench                       run every case
+#   python -m chip8asm.bench --save base.json      store a baseline
+#   python -m chip8asm.bench --compare base.json   exit 1 on a regression
+#
+# Every run also checks the memory the syntax tree keeps per statement
+# against AST_BUDGET, the errors reported for DIAGNOSTICS and the tokens of
+# --fuzz random sources against the old tokenizer (reference_tokenizer.py),
+# and exits 1 when any of them is off.
+
+ARG_SAMPLES = {
+    ArgType.REG: '@5', ArgType.BYTE: '#a5', ArgType.NIBBLE: '!7', ArgType.ADDRESS: '[#2a4]',
+    ArgType.INDEX: 'I', ArgType.DELAY_TIMER: 'DT', ArgType.SOUND_TIMER: 'ST', ArgType.BCD: 'B',
+    ArgType.KEY: 'K', ArgType.FLAGS: 'F', ArgType.INDEX_ADDR: '[I]',
+}
+
+ROM_SIZE = 0x1000 - 0x200
+
+def commented_source(blocks=20000, seed=0):
+    rnd = random.Random(seed)
+    body = list()
+    for i in range(blocks):
+        body.append(f"; block {i}: {'lorem ipsum dolor sit amet ' * rnd.randint(1, 4)}")
+        body.append(f"label_{i}:")
+        body.append(f"    ld @{rnd.randint(0, 15)}, #{rnd.randint(0, 255):02x}    ; load")
+        body.append(f"    add @{rnd.randint(0, 15)}, {rnd.randint(0, 255)}")
+        body.append(f"    jp [label_{rnd.randint(0, blocks - 1)}]")
+        body.append("")
+    return '\n'.join(body)
+
+def every_form_source(repeat=5000):
+    lines = list()
+    for mnemo, args in INSTRUCTION_SET:
+        lines.append(f"{mnemo} {', '.join(ARG_SAMPLES[a] for a in args)}")
+    return '\n'.join(lines * repeat)
+
+# Every instruction is a jump target, names of up to 40 characters
+def label_heavy_source(labels=20000, seed=0):
+    rnd = random.Random(seed)
+    names = [f"{'l' * rnd.randint(1, 32)}_{i}" for i in range(labels)]
+    body = list()
+    for name in names:
+        body.append(f"{name}:")
+        body.append(f"    {rnd.choice(('jp', 'call'))} [{rnd.choice(names)}]")
+        body.append(f"    ld I, [{rnd.choice(names)}]")
+    return '\n'.join(body)
+
+# Sprite and lookup tables, the tokenizer sees mostly numbers
+def db_table_source(rows=5000, width=16, seed=0):
+    rnd = random.Random(seed)
+    body = list()
+    for i in range(rows):
+        if i % 16 == 0:
+            body.append(f"table_{i // 16}:")
+        body.append("    .db " + ', '.join(f"#{rnd.randint(0, 255):02x}" for _ in range(width)))
+    return '\n'.join(body)
+
+def random_args(rnd, args, labels):
+    for arg in args:
+        if arg == ArgType.REG: yield f"@{rnd.randint(0, 15)}"
+        elif arg == ArgType.BYTE: yield f"#{rnd.randint(0, 255):02x}"
+        elif arg == ArgType.NIBBLE: yield f"!{rnd.randint(1, 15)}"
+        elif arg == ArgType.ADDRESS: yield f"[{rnd.choice(labels)}]"
+        else: yield ARG_SAMPLES[arg]
+
+# A program that fills the whole address space: code, then a data table
+def max_rom_source(seed=0, data=256):
+    rnd = random.Random(seed)
+    forms = list(INSTRUCTION_SET)
+    count = (ROM_SIZE - data) // 2
+    labels = [f"loc_{i}" for i in range(0, count, 8)] + ['data']
+
+    body = ['; generated, fills the address space', '.org [#200]']
+    for i in range(count):
+        if i % 8 == 0:
+            body.append(f"loc_{i}:")
+        mnemo, args = rnd.choice(forms)
+        line = f"    {mnemo} {', '.join(random_args(rnd, args, labels))}"
+        body.append(line + ("    ; note" if rnd.random() < 0.2 else ""))
+    body.append("data:")
+    for i in range(0, data, 16):
+        body.append("    .db " + ', '.join(str(rnd.randint(0, 255)) for _ in range(min(16, data - i))))
+    return '\n'.join(body)
+
+CASES = {
+    'every_form': lambda scale: every_form_source(max(1, round(250 * scale))),
+    'labels': lambda scale: label_heavy_source(max(1, round(5000 * scale))),
+    'db_tables': lambda scale: db_table_source(max(1, round(1000 * scale))),
+    'comments': lambda scale: commented_source(max(1, round(2500 * scale))),
+    'max_rom': lambda scale: max_rom_source(),
+}
+
+# Bytes the parsed and preprocessed tree of a case may keep per statement,
+# checked on every run
+AST_BUDGET = {
+    'every_form': 320,
+    'labels': 320,
+    'db_tables': 1536,
+    'comments': 320,
+    'max_rom': 320,
+}
+
+# Sources every assembler must reject with this message instead of raising,
+# checked before every run. Sources with several errors must report the
+# same one on every path: tokenize errors first, then parse errors, then
+# unknown labels.
+DIAGNOSTICS = {
+    'jp [nowhere]': "Unknown ID 'nowhere'",
+    '.db foo': "Unknown ID 'foo'",
+    'cls\n.db 1, foo, 2': "Unknown ID 'foo'",
+    'ld @1, 2\n.db later\n': "Unknown ID 'later'",
+    '.org [foo]': "Unknown ID 'foo'",
+    'jp [start]\n.org [start]\nstart: ret': "Unknown ID 'start'",
+    'jp [nowhere]\nld': "check.asm,0:1:1 Unknown ID 'nowhere'",
+    'ld @1,\nadd @1, #ff\n#': "check.asm,20:3:2 Tokenize error: Wrong HEX",
+    '.db x\nld @1,': "check.asm,12:2:7 Unexcepted end of args",
+    'drw @1, @2\n.db x': "check.asm,12:2:2 Unknown ID 'x'",
+    'jp [a]\n.db b\n.org [c]': "check.asm,14:3:2 Unknown ID 'c'",
+}
+
+def assemble_incremental(source):
+    return IncrementalAssembler().assemble(source.name, source.source)
+
+def check_diagnostics():
+    wrong = list()
+    for source, message in DIAGNOSTICS.items():
+        for build in (assemble, assemble_reference, assemble_incremental):
+            success, _, diagnostics = build(Source('check.asm', source))
+            if success or not diagnostics.endswith(message):
+                wrong.append(f"{build.__name__}({source!r}): {diagnostics}")
+    return wrong
+
+# Random sources for the differential check against the old tokenizer:
+# every token class, malformed numbers, unicode letters and digits, and
+# characters neither tokenizer accepts
+FRAGMENTS = [
+    'ld', 'cls', 'sknp', 'I', 'DT', 'K', 'label', 'loop_2', 'Змейка', 'é', 'x²', '٣',
+    '0', '42', '007', '#ff', '#0', '$01', '$1',
+    '.', ',', ':', '@', '[', ']', '(', ')', '{', '}', '!',
+    '; comment', ';', ' ', '  ', '\t', '\n', '\r\n',
+]
+RARE = ['1a', '#', '#fg', '#A', '$', '$012', '$1b', '²', '_', '-', '?', '🐍']
+
+def fuzz_source(rnd):
+    return ''.join(rnd.choice(RARE if rnd.random() < 0.02 else FRAGMENTS) for _ in range(rnd.randint(0, 40)))
+
+def reference_tokens(path, source):
+    try:
+        tokens = reference_tokenizer.tokenize(path, source)
+    except reference_tokenizer.TokenizeError as err:
+        return 'error', repr(err.location), err.message
+    except (reference_tokenizer.Stuck, ValueError):
+        return None # Loops forever or crashes there, must be a TokenizeError now
+    return [(t.type.name, t.value, repr(t.location)) for t in tokens]
+
+def current_tokens(path, source):
+    try:
+        tokens = tokenize(path, source)
+    except TokenizeError as err:
+        return 'error', repr(err.location), err.message
+    return [(t.type.name, t.value, repr(Location(tokens.source, t.pos))) for t in tokens]
+
+# Sources where mytoken.tokenize() differs from the old tokenizer: type,
+# value, position, line and column of every token, or the same error
+def tokenizer_differences(count, seed=0):
+    rnd = random.Random(seed)
+    differences = list()
+    for _ in range(count):
+        source = fuzz_source(rnd)
+        expected = reference_tokens('fuzz.asm', source)
+        actual = current_tokens('fuzz.asm', source)
+        if expected is None:
+            if actual[0] != 'error': differences.append(source)
+        elif expected != actual:
+            differences.append(source)
+    return differences
+
+STAGES = ('tokenize', 'parse', 'calculate', 'preprocess', 'generate', 'three_pass', 'stream', 'object', 'link', 'disassemble')
+
+def calculated(tokens):
+    ast, env = Parser(tokens).parse(), Env()
+    for statement in ast: statement.calculate(env)
+    return ast, env
+
+def preprocessed(tokens):
+    ast, env = calculated(tokens)
+    return [statement.preprocess(env) for statement in ast], env
+
+def run_calculate(ast):
+    env = Env()
+    for statement in ast: statement.calculate(env)
+    return env
+
+def run_preprocess(ast, env):
+    return [statement.preprocess(env) for statement in ast]
+
+def three_pass(name, source):
+    return generate(*preprocessed(tokenize(name, source)))
+
+# stage -> (setup, run, needs fresh state per run)
+def stage_plan(name, source):
+    tokens = tokenize(name, source)
+    ast, env = preprocessed(tokens)
+    code = generate(ast, env)
+    return tokens, len(ast), {
+        'tokenize': (lambda: (name, source), tokenize, False),
+        'parse': (lambda: (tokens,), lambda tokens: Parser(tokens).parse(), False),
+        'calculate': (lambda: (Parser(tokens).parse(),), run_calculate, False),
+        'preprocess': (lambda: calculated(tokens), run_preprocess, False),
+        'generate': (lambda: (ast, env), generate, False),
+        'three_pass': (lambda: (name, source), three_pass, False),
+        'stream': (lambda: (name, source), assemble_stream, False),
+        'object': (lambda: (name, source), assemble_object, False),
+        'link': (lambda: ([assemble_object(name, source)],), link, False),
+        'disassemble': (lambda: (code,), disassemble, False),
+    }
+
+def sample(setup, run, fresh, loops):
+    if fresh:
+        states = [setup() for _ in range(loops)]
+    else:
+        states = [setup()] * loops
+    start = perf_counter()
+    for state in states:
+        run(*state)
+    return perf_counter() - start
+
+def peak_memory(setup, run):
+    state = setup()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        result = run(*state)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+# Memory still held by the tree once parsing and preprocess are done
+def ast_bytes(tokens):
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        ast, env = preprocessed(tokens)
+        used = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    return used / len(ast)
+
+def measure(setup, run, fresh, repeat=5, min_time=0.02):
+    first = sample(setup, run, fresh, 1)
+    loops = max(1, math.ceil(min_time / max(first, 1e-9)))
+    best = min(sample(setup, run, fresh, loops) for _ in range(repeat)) / loops
+    return best, peak_memory(setup, run)
+
+def run_case(name, source, repeat=5):
+    tokens, statements, plan = stage_plan(f"{name}.asm", source)
+    code = three_pass(f"{name}.asm", source)
+    if assemble_stream(f"{name}.asm", source).code != code:
+        sys.exit(f"{name}: streaming and three pass builds differ")
+    if link([assemble_object(f"{name}.asm", source)]) != code:
+        sys.exit(f"{name}: linked and three pass builds differ")
+    if assemble_stream(f"{name}.asm", disassemble(code)).code != code:
+        sys.exit(f"{name}: disassembly does not assemble back to the same bytes")
+    results = dict()
+    for stage in STAGES:
+        seconds, peak = measure(*plan[stage], repeat=repeat)
+        units = len(tokens) if stage == 'tokenize' else statements
+        results[stage] = {
+            'seconds': seconds,
+            'ops_per_sec': units / seconds,
+            'peak_bytes': peak,
+        }
+    return {'chars': len(source), 'tokens': len(tokens), 'statements': statements,
+            'ast_bytes': ast_bytes(tokens), 'stages': results}
+
+def run_suite(cases, scale=1.0, repeat=5):
+    results = dict()
+    for name in cases:
+        source = CASES[name](scale)
+        results[name] = case = run_case(name, source, repeat)
+        print(f"{name}: {case['chars']} chars, {case['tokens']} tokens, {case['statements']} statements, "
+              f"{case['ast_bytes']:.0f} B/statement in the tree")
+        for stage, r in case['stages'].items():
+            print(f"    {stage:<12} {r['seconds'] * 1000:10.2f} ms {r['ops_per_sec']:14,.0f} ops/s "
+                  f"{r['peak_bytes'] / 1024:10.1f} KiB peak")
+    return results
+
+def over_budget(results):
+    over = list()
+    for name, case in results.items():
+        if case['ast_bytes'] > AST_BUDGET[name]:
+            print(f"{name}: tree takes {case['ast_bytes']:.0f} B/statement, budget is {AST_BUDGET[name]}")
+            over.append(f"{name}/ast_bytes")
+    return over
+
+def compare(results, baseline, threshold, memory_threshold):
+    regressions = list()
+    for name, case in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if old['chars'] != case['chars']:
+            print(f"{name}: source differs from the baseline, skipped")
+            continue
+        if 'ast_bytes' in old:
+            ratio = case['ast_bytes'] / old['ast_bytes']
+            mark = ' REGRESSION' if ratio > 1 + memory_threshold else ''
+            print(f"{name + '/ast_bytes':<24} memory {ratio - 1:+8.1%}{mark}")
+            if mark:
+                regressions.append(f"{name}/ast_bytes")
+        for stage, r in case['stages'].items():
+            before = old['stages'].get(stage)
+            if before is None:
+                continue
+            time_ratio = r['seconds'] / before['seconds']
+            memory_ratio = r['peak_bytes'] / max(before['peak_bytes'], 1)
+            slow = time_ratio > 1 + threshold
+            big = memory_ratio > 1 + memory_threshold
+            mark = ' REGRESSION' if slow or big else ''
+            print(f"{name + '/' + stage:<24} time {time_ratio - 1:+8.1%}  memory {memory_ratio - 1:+8.1%}{mark}")
+            if slow or big:
+                regressions.append(f"{name}/{stage}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chip8asm.bench', description='CHIP-8 assembler benchmarks')
+    parser.add_argument('cases', nargs='*', metavar='CASE',
+        help=f"cases to run (default: all of {', '.join(CASES)})")
+    parser.add_argument('--scale', type=float, default=1.0, help='size multiplier for generated sources')
+    parser.add_argument('--repeat', type=int, default=5, help='samples per stage, the best one counts')
+    parser.add_argument('--fuzz', type=int, default=2000, metavar='N',
+        help='random sources to compare with the old tokenizer (default: 2000)')
+    parser.add_argument('--save', metavar='FILE', help='write results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+        help='allowed slowdown per stage, as a fraction (default: 0.25)')
+    parser.add_argument('--memory-threshold', type=float, default=0.10,
+        help='allowed peak memory growth per stage (default: 0.10)')
+    args = parser.parse_args(argv)
+    for name in args.cases:
+        if name not in CASES:
+            parser.error(f"unknown case '{name}'")
+
+    wrong = check_diagnostics()
+    if wrong:
+        sys.exit('\n'.join(['Wrong diagnostics:', *wrong]))
+    differences = tokenizer_differences(args.fuzz)
+    if differences:
+        sys.exit('\n'.join(['Tokens differ from the old tokenizer for:', *map(repr, differences[:10])]))
+
+    results = run_suite(args.cases or list(CASES), args.scale, args.repeat)
+    regressions = over_budget(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'scale': args.scale, 'cases': results}, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['scale'] != args.scale:
+            sys.exit(f"Baseline was recorded with --scale {baseline['scale']}")
+        regressions += compare(results, baseline['cases'], args.threshold, args.memory_threshold)
+
+    if regressions:
+        sys.exit(f"Regressed: {', '.join(regressions)}")
+
+if __name__ == '__main__':
+    main()
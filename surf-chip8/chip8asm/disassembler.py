@@ -0,0 +1,193 @@
+from .myast import INSTRUCTION_SET, ArgType, operand_fields
+from .mymain import collect
+from itertools import product
+import argparse
+import os
+import sys
+
+# ROMs back to source. Every 16-bit word is decoded with one lookup in
+# DECODE, built at import from INSTRUCTION_SET: an entry exists only for
+# words an instruction of the set encodes to, so assembling the text of an
+# entry always gives the same word back. Words without one become .db.
+#
+# Code is found by following jumps, calls and skips from the first byte;
+# everything else is data. Jump, call and ld I targets get labels when they
+# fall on the start of a statement, other targets stay literal addresses.
+
+BASE = 0x200
+
+# Control flow of a decoded word
+NEXT, JUMP, CALL, STOP, SKIP, POINTER = range(6)
+
+FLOW = {
+    ('jp', (ArgType.ADDRESS,)): JUMP,
+    ('call', (ArgType.ADDRESS,)): CALL,
+    ('ret', tuple()): STOP,
+    ('jp', (ArgType.REG, ArgType.ADDRESS)): STOP,
+    ('se', (ArgType.REG, ArgType.BYTE)): SKIP,
+    ('sne', (ArgType.REG, ArgType.BYTE)): SKIP,
+    ('se', (ArgType.REG, ArgType.REG)): SKIP,
+    ('sne', (ArgType.REG, ArgType.REG)): SKIP,
+    ('skp', (ArgType.REG,)): SKIP,
+    ('sknp', (ArgType.REG,)): SKIP,
+    ('ld', (ArgType.INDEX, ArgType.ADDRESS)): POINTER,
+}
+
+KEYWORDS = {
+    ArgType.INDEX: 'I', ArgType.DELAY_TIMER: 'DT', ArgType.SOUND_TIMER: 'ST', ArgType.BCD: 'B',
+    ArgType.KEY: 'K', ArgType.FLAGS: 'F', ArgType.INDEX_ADDR: '[I]',
+}
+
+# Labels by the kind of reference, the first one wins
+PREFIXES = {CALL: 'func', JUMP: 'loc', POINTER: 'data'}
+
+def format_arg(type_, value):
+    if type_ == ArgType.REG: return f"@{value}"
+    elif type_ == ArgType.BYTE: return f"#{value:02x}"
+    elif type_ == ArgType.NIBBLE: return f"!{value}"
+    elif type_ == ArgType.ADDRESS: return '[{}]' if value is not None else '[#000]'
+    return KEYWORDS[type_]
+
+# word -> (flow, text, target): text has a {} for the target of address forms
+def build_table():
+    table = [None] * 0x10000
+    for (mnemo, args), opcode in INSTRUCTION_SET.items():
+        fields = operand_fields(args)
+        flow = FLOW.get((mnemo, args), NEXT)
+        # (word bits, text, target) of every value each argument can take
+        # Arguments without a field (keywords, the address of jp @0) have one
+        choices = {i: [(v << shift, format_arg(args[i], v), v if args[i] == ArgType.ADDRESS else None)
+                       for v in range(mask + 1)] for i, mask, shift in fields}
+        choices = [choices.get(i) or [(0, format_arg(type_, None), None)] for i, type_ in enumerate(args)]
+        for values in product(*choices):
+            word = opcode
+            target = None
+            for bits, _, value in values:
+                word |= bits
+                target = value if value is not None else target
+            text = ', '.join(text for _, text, _ in values)
+            assert table[word] is None, f"{word:04x} encodes two instructions"
+            table[word] = (flow, f"{mnemo} {text}" if text else mnemo, target)
+    return table
+
+DECODE = build_table()
+
+def find_code(rom, base):
+    code = set()
+    todo = [0]
+    while todo:
+        pos = todo.pop()
+        while 0 <= pos < len(rom) - 1 and pos not in code:
+            entry = DECODE[rom[pos] << 8 | rom[pos + 1]]
+            if entry is None: break
+            code.add(pos)
+            flow, _, target = entry
+            if flow == JUMP:
+                pos = target - base
+                continue
+            elif flow == CALL:
+                todo.append(target - base)
+            elif flow == SKIP:
+                todo.append(pos + 4)
+            elif flow == STOP:
+                break
+            pos += 2
+    return code
+
+def disassemble(rom, base=BASE, row=8):
+    code = find_code(rom, base)
+
+    # Instructions that overlap an earlier one are left to it
+    statements = list()
+    starts = bytearray(len(rom) + 1)
+    starts[len(rom)] = 1
+    pos = 0
+    while pos < len(rom):
+        if pos in code:
+            statements.append((pos, DECODE[rom[pos] << 8 | rom[pos + 1]]))
+            starts[pos] = 1
+            pos += 2
+        else:
+            statements.append((pos, None))
+            starts[pos] = 1
+            pos += 1
+
+    labels = dict()
+    for pos, entry in statements:
+        if entry is None or entry[0] not in PREFIXES: continue
+        flow, _, target = entry
+        offset = target - base
+        if 0 <= offset <= len(rom) and starts[offset]:
+            labels.setdefault(offset, set()).add(flow)
+    names = {offset: next(f"{PREFIXES[flow]}_{base + offset:03x}" for flow in PREFIXES if flow in flows)
+             for offset, flows in labels.items()}
+
+    lines = [f".org [#{base:03x}]"]
+    data = list()
+    def flush():
+        if data:
+            lines.append("    .db " + ', '.join(f"#{byte:02x}" for byte in data))
+            data.clear()
+
+    for pos, entry in statements:
+        if pos in names:
+            flush()
+            lines.append(f"{names[pos]}:")
+        if entry is None:
+            data.append(rom[pos])
+            if len(data) == row: flush()
+            continue
+        flush()
+        flow, text, target = entry
+        if target is not None and '{}' in text:
+            offset = target - base
+            text = text.format(names[offset] if offset in names else f"#{target:03x}")
+        lines.append(f"    {text}")
+    flush()
+    if len(rom) in names:
+        lines.append(f"{names[len(rom)]}:")
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    from .stream import assemble_stream
+
+    parser = argparse.ArgumentParser(prog='python -m chip8asm.disassembler', description='CHIP-8 disassembler')
+    parser.add_argument('inputs', nargs='+', help='ROM files, directories or globs')
+    parser.add_argument('-o', '--output', help='output directory, next to the ROM by default')
+    parser.add_argument('-p', '--pattern', default='*.ch8', help='ROMs to pick from directories')
+    parser.add_argument('-s', '--suffix', default='.asm', help='output file suffix')
+    parser.add_argument('--base', type=lambda x: int(x, 0), default=BASE, help='load address (default: 0x200)')
+    parser.add_argument('--verify', action='store_true', help='assemble every output again and compare the bytes')
+    parser.add_argument('-v', '--verbose', action='store_true', help='list every file')
+    args = parser.parse_args(argv)
+
+    done = failed = 0
+    for path in collect(args.inputs, args.pattern):
+        try:
+            with open(path, 'rb') as f:
+                rom = f.read()
+        except OSError as err:
+            print(f"{path}: {err}", file=sys.stderr)
+            failed += 1
+            continue
+
+        source = disassemble(rom, args.base)
+        if args.verify and assemble_stream(path, source).code != rom:
+            print(f"{path}: source does not assemble back to the same bytes", file=sys.stderr)
+            failed += 1
+            continue
+
+        name = os.path.splitext(os.path.basename(path))[0] + args.suffix
+        output = os.path.join(args.output or os.path.dirname(path), name)
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(source)
+        done += 1
+        if args.verbose: print(f"{path} -> {output}")
+
+    print(f"{done + failed} ROMs: {done} disassembled, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
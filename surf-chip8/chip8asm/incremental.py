@@ -0,0 +1,166 @@
+import hashlib
+import io
+
+from .mytoken import *
+from .myast import *
+from .myparser import Parser
+from .mymain import Env
+
+# Incremental rebuilds for the editor. Tokens are cached per source line,
+# statements per chunk of lines and encoded bytes per statement, keyed on
+# the values of the labels it references. Each cache only keeps what the
+# latest successful build used, so memory follows the current program.
+#
+# A chunk is a run of lines that starts and ends on a statement boundary.
+# Parsing a chunk only looks at its own tokens and at most two tokens of
+# lookahead, so the result is reused whenever the chunk text and the
+# lookahead are unchanged. Statements that run over a line end (the parser
+# allows that) simply grow the chunk until it is closed again.
+
+def rebase(err, source, base):
+    return type(err)(Location(source, base + err.location.pos), err.message)
+
+def dependencies(statement):
+    args = getattr(statement, 'args', ())
+    return [arg.value.name for arg in args if type(arg.value) == Identifier]
+
+class IncrementalAssembler:
+    def __init__(self):
+        self.source = ''
+        self.revision = hashlib.sha256(b'').hexdigest()
+        self.lines = dict()
+        self.chunks = dict()
+        self.code = dict()
+
+    def apply(self, start, end, text):
+        if not (0 <= start <= end <= len(self.source)):
+            raise ValueError("Edit is out of source bounds")
+        return self.source[:start] + text + self.source[end:]
+
+    def tokenize(self, source, path, text):
+        lines = dict()
+        result = list()
+        start = 0
+
+        for line in text.split('\n'):
+            tokens = self.lines.get(line)
+            if tokens is None:
+                try:
+                    tokens = tokenize(path, line)[:-1]
+                except TokenizeError as err:
+                    raise rebase(err, source, start)
+            lines[line] = tokens
+            if tokens: result.append((start, line, tokens))
+            start += len(line) + 1
+
+        self.lines = lines
+        return result
+
+    def parse_chunk(self, source, path, text, lines, i, j):
+        start = lines[i][0]
+        end = lines[j - 1][0] + len(lines[j - 1][1])
+
+        lookahead = list()
+        reach = end
+        for line_start, line, tokens in lines[j:]:
+            lookahead += [(t, line_start + t.pos) for t in tokens[:2 - len(lookahead)]]
+            reach = line_start + len(line)
+            if len(lookahead) == 2: break
+
+        # The parse only depends on the text up to the last lookahead token
+        key = (end - start, text[start:reach])
+        if key in self.chunks:
+            return key, self.chunks[key], False
+
+        tokens = Tokens(SourceText(path, text[start:end]))
+        for line_start, _, line_tokens in lines[i:j]:
+            for t in line_tokens:
+                tokens.append(Token(t.type, t.value, line_start - start + t.pos))
+        length = len(tokens)
+        for t, pos in lookahead:
+            tokens.append(Token(t.type, t.value, pos - start))
+        tokens.append(Token(TokenType.EOF, '', len(text) - start))
+
+        parser = Parser(tokens)
+        statements = list()
+        try:
+            while parser.pos < length:
+                statements.append(parser.statement())
+        except ChipSyntaxError as err:
+            # Errors past the chunk end may be an artifact of the cut lookahead
+            if parser.pos <= length or j == len(lines):
+                raise rebase(err, source, start)
+            return key, None, True
+
+        return key, statements, parser.pos > length and j < len(lines)
+
+    def parse(self, source, path, text, lines):
+        chunks = dict()
+        ast = list()
+        i = 0
+
+        while i < len(lines):
+            j = i + 1
+            key, statements, open_ = self.parse_chunk(source, path, text, lines, i, j)
+            while open_:
+                j += 1
+                key, statements, open_ = self.parse_chunk(source, path, text, lines, i, j)
+
+            chunks[key] = statements
+            ast += [(statement, lines[i][0]) for statement in statements]
+            i = j
+
+        self.chunks = chunks
+        return ast
+
+    def build(self, source, ast):
+        env = Env()
+        for statement, base in ast:
+            try:
+                statement.calculate(env)
+            except ChipSyntaxError as err:
+                raise rebase(err, source, base)
+
+        code = dict()
+        pending = list()
+        labels = env.c.get
+        for statement, base in ast:
+            cached = self.code.get(statement)
+            if cached is not None and [labels(name) for name in cached[0]] == cached[1]:
+                code[statement] = cached
+                continue
+            names = dependencies(statement)
+            deps = [labels(name) for name in names]
+
+            try:
+                work = statement.preprocess(env)
+            except ChipSyntaxError as err:
+                raise rebase(err, source, base)
+            pending.append((statement, names, deps, work, base))
+
+        for statement, names, deps, work, base in pending:
+            out = bytearray(work.size)
+            try:
+                work.emit(env, out, 0)
+            except ChipSyntaxError as err:
+                raise rebase(err, source, base)
+            code[statement] = (names, deps, bytes(out))
+
+        self.code = code
+        return b''.join(code[statement][2] for statement, _ in ast)
+
+    def assemble(self, path, text):
+        source = SourceText(path, text)
+        self.source = text
+        self.revision = hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+        try:
+            lines = self.tokenize(source, path, text)
+            ast = self.parse(source, path, text, lines)
+            code = self.build(source, ast)
+        except TokenizeError as err:
+            return False, None, str(err)
+        except ChipSyntaxError as err:
+            return False, None, str(err)
+        else:
+            return True, io.BytesIO(code), "Success!"
@@ -0,0 +1,152 @@
+from .mytoken import SourceText, TokenizeError, scan
+from .myast import *
+from .myparser import StreamParser
+from .mymain import Env
+from .stream import references, patch
+from .batch import Result
+import base64
+import json
+
+# Relocatable objects. A source is assembled once at address 0 with every
+# label field left zero; each field that uses a label becomes a relocation
+# (offset, width, mask, shift, label) and every label is exported with its
+# offset in the code. link() places objects one after another from a base
+# address and patches the fields, so shared routines are assembled once and
+# only linked into every program that uses them.
+#
+# A label is looked up in the object that uses it first, then in the others.
+# Labels defined by several objects can only be used inside each of them.
+# .org may only come before any code or label: it sets the default base.
+
+OBJECT_FORMAT = 1
+
+class LinkError(BaseException):
+    def __init__(self, path, message):
+        super().__init__(self)
+        self.path = path
+        self.message = message
+
+    def __repr__(self):
+        return f"{self.path} Link error: {self.message}"
+
+    def __str__(self):
+        return self.__repr__()
+
+class Unresolved:
+    # Labels are encoded as zero, the linker fills them in
+    def get(self, name):
+        return 0
+
+class ObjectFile:
+    def __init__(self, path, code, symbols, relocations, origin=None):
+        self.path = path
+        self.code = code
+        self.symbols = symbols
+        self.relocations = relocations
+        self.origin = origin
+
+    def dumps(self):
+        return json.dumps({
+            'format': OBJECT_FORMAT,
+            'path': self.path,
+            'origin': self.origin,
+            'code': base64.b64encode(self.code).decode('ascii'),
+            'symbols': self.symbols,
+            'relocations': self.relocations,
+        }, separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, data):
+        obj = json.loads(data)
+        if obj.get('format') != OBJECT_FORMAT:
+            raise ValueError(f"Unsupported object format {obj.get('format')!r}")
+        return cls(obj['path'], base64.b64decode(obj['code']), obj['symbols'],
+                   [tuple(r) for r in obj['relocations']], obj['origin'])
+
+def assemble_object(path, source):
+    text = SourceText(path, source)
+    parser = StreamParser(text, scan(text))
+    env = Env()
+    zero = Unresolved()
+    code = bytearray()
+    relocations = list()
+    origin = None
+
+    for statement in parser.statements():
+        if type(statement) == Directive and statement.name == 'org':
+            if code or env.c:
+                raise ChipSyntaxError(statement.location, "DIRECTIVE 'org' must come before any code or label in an object")
+            statement.calculate(env)
+            origin, env.address = env.address, 0
+            continue
+        statement.calculate(env)
+
+        size = statement.size
+        if not size: continue
+        pos = len(code)
+        code.extend(bytes(size))
+        statement.emit(zero, code, pos)
+        for offset, width, name, mask, shift in references(statement):
+            relocations.append((pos + offset, width, mask, shift, name))
+
+    return ObjectFile(path, bytes(code), env.c, relocations, origin)
+
+def link(objects, base=None):
+    if not objects:
+        return bytearray()
+    for obj in objects[1:]:
+        if obj.origin is not None:
+            raise LinkError(obj.path, "Only the first object may set .org")
+    if base is None:
+        base = objects[0].origin or 0
+
+    addresses = list()
+    exports = dict()
+    ambiguous = dict()
+    address = base
+    for obj in objects:
+        addresses.append(address)
+        for name, offset in obj.symbols.items():
+            if name in exports:
+                ambiguous.setdefault(name, [exports[name][0]]).append(obj.path)
+            else:
+                exports[name] = (obj.path, address + offset)
+        address += len(obj.code)
+
+    code = bytearray(b''.join(obj.code for obj in objects))
+    pos = 0
+    for obj, address in zip(objects, addresses):
+        for offset, width, mask, shift, name in obj.relocations:
+            if name in obj.symbols:
+                value = address + obj.symbols[name]
+            elif name in ambiguous:
+                raise LinkError(obj.path, f"{Identifier(name)} is defined in {', '.join(ambiguous[name])}")
+            elif name in exports:
+                value = exports[name][1]
+            else:
+                raise LinkError(obj.path, f"Unknown {Identifier(name)}")
+            patch(code, pos + offset, width, mask, shift, value)
+        pos += len(obj.code)
+    return code
+
+# Batch workers, see assemble_item(): items are (index, name, source) and
+# (index, name, source, libraries, base)
+def compile_item(item):
+    index, name, source = item
+    try:
+        obj = assemble_object(name, source)
+    except (TokenizeError, ChipSyntaxError) as err:
+        return Result(index, name, False, None, str(err))
+    except Exception as err:
+        return Result(index, name, False, None, f"{name} Internal error: {err!r}")
+    return Result(index, name, True, obj.dumps().encode('utf-8'), "Success!")
+
+def link_item(item):
+    index, name, source, libraries, base = item
+    try:
+        code = link([assemble_object(name, source), *libraries], base)
+    except (TokenizeError, ChipSyntaxError, LinkError) as err:
+        return Result(index, name, False, None, str(err))
+    except Exception as err:
+        return Result(index, name, False, None, f"{name} Internal error: {err!r}")
+    return Result(index, name, True, bytes(code), "Success!")
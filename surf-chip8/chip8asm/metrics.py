@@ -0,0 +1,78 @@
+from bisect import bisect_left
+import threading
+
+# Minimal Prometheus style counters and histograms, kept per process.
+# Every metric registers itself and render() returns the text format.
+
+REGISTRY = list()
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    type_ = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = dict()
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+class Histogram:
+    type_ = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = dict() # labels -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            row = self.values.get(labels)
+            if row is None:
+                row = self.values[labels] = [0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, list(row)) for labels, row in self.values.items())
+        for labels, row in values:
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), row):
+                total += count
+                yield f"{self.name}_bucket{format_labels(self.labels, labels, [('le', bound)])} {total}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {row[-1]}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {total}"
+
+def render():
+    lines = list()
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type_}")
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
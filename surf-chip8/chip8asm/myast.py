@@ -13,17 +13,23 @@ class ChipSyntaxError(BaseException):
     def __str__(self):
         return self.__repr__()
 
+# Nodes have no __dict__ and are not changed once parsed: preprocess()
+# returns a node with labels resolved, or the same node if it has none.
 class Statement:
+    __slots__ = ()
+    size = 0
     def calculate(self, env): pass
-    def preprocess(self, env): pass
-    def generate(self, env): return []
+    def preprocess(self, env): return self
+    def emit(self, env, code, pos): return pos
     def locate(): return self.location
 
-class Value: pass
+class Value:
+    __slots__ = ()
 
+@dataclass(frozen=True)
 class Identifier(Value):
-    def __init__(self, name):
-        self.name = name
+    __slots__ = ('name',)
+    name: str
 
     def get(self, env):
         return env.get(self.name)
@@ -31,9 +37,10 @@ class Identifier(Value):
     def __repr__(self):
         return f"ID '{self.name}'"
 
+@dataclass(frozen=True)
 class Number(Value):
-    def __init__(self, v):
-        self.v = v
+    __slots__ = ('v',)
+    v: int
 
     def get(self, env):
         return self.v
@@ -41,13 +48,24 @@ class Number(Value):
     def __repr__(self):
         return f"NUM {self.v}"
 
+@dataclass(frozen=True)
 class NullValue(Value):
+    __slots__ = ()
+
     def get(self, v):
         return 0
 
     def __repr__(self):
         return f"NULL"
 
+NULL = NullValue()
+
+# Values are immutable, registers and bytes share one object per value
+SMALL_NUMBERS = [Number(v) for v in range(256)]
+
+def number(v):
+    return SMALL_NUMBERS[v] if 0 <= v < 256 else Number(v)
+
 class ArgType(Enum):
     INDEX = 1
     DELAY_TIMER = 2
@@ -61,8 +79,9 @@ class ArgType(Enum):
     NIBBLE = 10
     INDEX_ADDR = 11
 
-@dataclass
+@dataclass(frozen=True)
 class Argument:
+    __slots__ = ('type_', 'value')
     type_: ArgType
     value: Value
 
@@ -71,7 +90,7 @@ class Argument:
 
     def preprocess(self, env):
         if type(self.value) == Identifier:
-            return Argument(self.type_, Number(self.value.get(env)))
+            return Argument(self.type_, number(self.value.get(env)))
         else: return self
 
     def get(self, env, requested_type=None):
@@ -90,6 +109,8 @@ class Argument:
             
 
 class Label(Statement):
+    __slots__ = ('name', 'location')
+
     def __init__(self, name, location):
         self.location = location
         self.name = name
@@ -100,38 +121,6 @@ class Label(Statement):
     def calculate(self, env):
         env.define(self.name)
 
-def nnn(opcode, addr):
-    return opcode | (addr & 0xfff)
-
-def n(opcode, nib):
-    return opcode | (nib & 0xf)
-
-def vx(opcode, r):
-    return opcode | ((r & 0xf) << 8)
-
-def vy(opcode, r):
-    return opcode | ((r & 0xf) << 4)
-
-def kk(opcode, v):
-    return opcode | (v & 0xff)
-
-def vx_vy(opcode, args, env):
-    return vx(vy(opcode, args[1].get(env)), args[0].get(env))
-
-def vx_kk(opcode, args, env):
-    return vx(kk(opcode, args[1].get(env)), args[0].get(env))
-
-def vx_vy_n(opcode, args, env):
-    return kk(vx_vy(opcode, args, env), args[2].get(env))
-
-def vx_src(opcode, args, env):
-    return vx(opcode, args[0].get(env))
-
-def vx_dest(opcode, args, env):
-    return vx(opcode, args[1].get(env))
-
-def narg(opcode, args, env): pass
-
 INSTRUCTION_SET = {
     ('cls', tuple()): 0x00e0,
     ('ret', tuple()): 0x00ee,
@@ -169,15 +158,68 @@ INSTRUCTION_SET = {
     ('ld', (ArgType.REG, ArgType.INDEX_ADDR)): 0xf065
 }
 
+VX = (0xf, 8)
+VY = (0xf, 4)
+KK = (0xff, 0)
+N = (0xf, 0)
+NNN = (0xfff, 0)
+
+# (arg index, mask, shift) of every operand encoded into the opcode
+def operand_fields(args):
+    if args == tuple():
+        return []
+    elif args == (ArgType.REG, ArgType.REG):
+        return [(0, *VX), (1, *VY)]
+    elif args == (ArgType.REG, ArgType.BYTE):
+        return [(0, *VX), (1, *KK)]
+    elif args == (ArgType.ADDRESS,):
+        return [(0, *NNN)]
+    elif args == (ArgType.REG, ArgType.REG, ArgType.NIBBLE):
+        return [(0, *VX), (1, *VY), (2, *N)]
+    elif args[0] == ArgType.REG:
+        return [(0, *VX)]
+    elif args[1] == ArgType.REG:
+        return [(1, *VX)]
+    elif args[1] == ArgType.ADDRESS:
+        return [(1, *NNN)]
+    return []
+
+def make_encoder(opcode, fields):
+    if len(fields) == 0:
+        return lambda args, env: opcode
+    elif len(fields) == 1:
+        (i, m, s), = fields
+        return lambda args, env: opcode | (args[i].value.get(env) & m) << s
+    elif len(fields) == 2:
+        (i, im, ish), (j, jm, jsh) = fields
+        return lambda args, env: opcode \
+            | (args[i].value.get(env) & im) << ish \
+            | (args[j].value.get(env) & jm) << jsh
+    else:
+        (i, im, ish), (j, jm, jsh), (k, km, ksh) = fields
+        return lambda args, env: opcode \
+            | (args[i].value.get(env) & im) << ish \
+            | (args[j].value.get(env) & jm) << jsh \
+            | (args[k].value.get(env) & km) << ksh
+
+# Resolved once at import, Instruction.emit is a single dict lookup
+ENCODERS = {
+    form: make_encoder(opcode, operand_fields(form[1]))
+    for form, opcode in INSTRUCTION_SET.items()
+}
+
+def resolved(args):
+    return all(type(arg.value) != Identifier for arg in args)
+
 class Instruction(Statement):
-    def __init__(self, mnemo, location):
+    __slots__ = ('mnemo', 'args', 'location')
+    size = 2
+
+    def __init__(self, mnemo, location, args=()):
         self.mnemo = mnemo
-        self.args = list()
+        self.args = args
         self.location = location
 
-    def append(self, arg):
-        self.args.append(arg)
-
     def __repr__(self):
         s = f"INSTRUCTION '{self.mnemo} ("
         for arg in self.args:
@@ -189,48 +231,34 @@ class Instruction(Statement):
         env.next(2)
 
     def preprocess(self, env):
-        try:
-            for i, arg in enumerate(self.args):
-                self.args[i] = arg.preprocess(env)
-        except:
-            raise ChipSyntaxError(self.location, f"Unknown {self.args[i].value}")
-
-    def generate(self, env):
-        form = (self.mnemo, tuple(map(lambda arg: arg.type_, self.args)))
-        if not (form in INSTRUCTION_SET):
+        if resolved(self.args): return self
+        args = list()
+        for arg in self.args:
+            try:
+                args.append(arg.preprocess(env))
+            except KeyError:
+                raise ChipSyntaxError(self.location, f"Unknown {arg.value}")
+        return Instruction(self.mnemo, self.location, tuple(args))
+
+    def emit(self, env, code, pos):
+        encode = ENCODERS.get((self.mnemo, tuple([arg.type_ for arg in self.args])))
+        if encode is None:
             raise ChipSyntaxError(self.location, f"Unknown INSTRUCTION '{self.mnemo}' or wrong args")
 
-        opcode = INSTRUCTION_SET[form]
-
-        if form[1] == tuple():
-            pass
-        elif form[1] == (ArgType.REG, ArgType.REG):
-            opcode = vx_vy(opcode, self.args, env)
-        elif form[1] == (ArgType.REG, ArgType.BYTE):
-            opcode = vx_kk(opcode, self.args, env)
-        elif form[1] == (ArgType.ADDRESS,):
-            opcode = nnn(opcode, self.args[0].get(env))
-        elif form[1] == (ArgType.REG, ArgType.REG, ArgType.NIBBLE):
-            opcode = vx_vy_n(opcode, self.args, env)
-        elif form[1][0] == ArgType.REG:
-            opcode = vx(opcode, self.args[0].get(env))
-        elif form[1][1] == ArgType.REG:
-            opcode = vx(opcode, self.args[1].get(env))
-        elif form[1][1] == ArgType.ADDRESS:
-            opcode = nnn(opcode, self.args[1].get(env))
-
-        return [(opcode >> 8) & 0xff, opcode & 0xff]
+        opcode = encode(self.args, env)
+        code[pos] = opcode >> 8
+        code[pos + 1] = opcode & 0xff
+        return pos + 2
         
 
 class Directive(Statement):
-    def __init__(self, name, location):
+    __slots__ = ('name', 'args', 'location')
+
+    def __init__(self, name, location, args=()):
         self.name = name
-        self.args = list()
+        self.args = args
         self.location = location
 
-    def append(self, arg):
-        self.args.append(arg)
-
     def __repr__(self):
         s = f"DIRECTIVE '{self.name} ("
         for arg in self.args:
@@ -242,23 +270,41 @@ class Directive(Statement):
         form = (self.name, tuple(map(lambda arg: arg.type_, self.args)))
         
         if self.name == 'org' and form[1] == (ArgType.ADDRESS,):
-            env.address = self.args[0].get(env)
+            try:
+                env.address = self.args[0].get(env)
+            except KeyError:
+                raise ChipSyntaxError(self.location, f"Unknown {self.args[0].value}")
         elif self.name == 'db' and len(self.args) != 0:
             env.next(len(self.args))
         else:
             raise ChipSyntaxError(self.location, f"Unknown DIRECTIVE '{self.name}' or wrong args here")
 
     def preprocess(self, env):
-        for i, arg in enumerate(self.args):
-            self.args[i] = arg.preprocess(env)
+        if resolved(self.args): return self
+        args = list()
+        for arg in self.args:
+            try:
+                args.append(arg.preprocess(env))
+            except KeyError:
+                raise ChipSyntaxError(self.location, f"Unknown {arg.value}")
+        return Directive(self.name, self.location, tuple(args))
 
-    def generate(self, env):
-        code = list()
-        
+    @property
+    def size(self):
+        return len(self.args) if self.name == 'db' else 0
+
+    def emit(self, env, code, pos):
         if self.name == 'db':
             for arg in self.args:
-                code.append(arg.get(env, requested_type=ArgType.BYTE))
-        
-        return code
+                code[pos] = arg.get(env, requested_type=ArgType.BYTE)
+                pos += 1
         
+        return pos
+
 
+def generate(ast, env):
+    code = bytearray(sum(statement.size for statement in ast))
+    pos = 0
+    for statement in ast:
+        pos = statement.emit(env, code, pos)
+    return code
@@ -1,6 +1,14 @@
 from .mytoken import *
 from .myast import *
 from .myparser import *
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
 
 class Env:
     def __init__(self, offset = 0):
@@ -17,37 +25,162 @@ class Env:
         return self.c[name]
 
 
+class BuildCache:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = dict()
 
+    def fresh(self, key, digest, output):
+        return self.entries.get(key) == {'hash': digest, 'output': output} and os.path.exists(output)
+
+    def store(self, key, digest, output):
+        self.entries[key] = {'hash': digest, 'output': output}
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+def collect(paths, pattern):
+    files = list()
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '**', pattern), recursive=True))
+        elif any(c in path for c in '*?['):
+            files += sorted(glob.glob(path, recursive=True))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def output_path(path, args):
+    name = os.path.splitext(os.path.basename(path))[0] + args.suffix
+    return os.path.join(args.output or os.path.dirname(path), name)
 
-if __name__ == '__main__':
-    code = list()
 
+def dump(path, source):
     try:
-        with open('src.ch8', 'r') as inp:
-            source = inp.read().strip()
-        
-        tokens = tokenize('src.ch8', source)
-        p = Parser(tokens)
-        ast = p.parse()
-        env = Env()
-        
-        for i in range(len(ast)): ast[i].calculate(env)
-        for i in range(len(ast)): ast[i].preprocess(env)
-        for i in range(len(ast)): code += ast[i].generate(env)
-        
-    except ChipSyntaxError as err:
+        tokens = tokenize(path, source)
+        print(*tokens, sep='\n')
+        print()
+        print(*Parser(tokens).parse(), sep='\n')
+    except (TokenizeError, ChipSyntaxError) as err:
         print(err)
-        #print(*tokens, sep='\n')
-        #print(*ast, sep='\n')
 
+
+def main(argv=None):
+    from .assembler import ASSEMBLER_VERSION
+    from .batch import assemble_item
+    from .linker import ObjectFile, compile_item, link_item
+
+    parser = argparse.ArgumentParser(prog='chip8asm', description='CHIP-8 assembler')
+    parser.add_argument('inputs', nargs='+', help='source files, directories or globs')
+    parser.add_argument('-o', '--output', help='output directory, next to the source by default')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='parallel workers')
+    parser.add_argument('-p', '--pattern', default='*.asm', help='sources to pick from directories')
+    parser.add_argument('-s', '--suffix', help='output file suffix (.bin, .o with -c)')
+    parser.add_argument('--cache', default='.chip8asm-cache.json', help='build cache file')
+    parser.add_argument('-f', '--force', action='store_true', help='ignore the build cache')
+    parser.add_argument('-O', '--optimize', action='store_true', help='run the optimizer, report what it saved')
+    parser.add_argument('-c', '--compile', action='store_true', help='write relocatable objects instead of ROMs')
+    parser.add_argument('-l', '--library', action='append', default=[], metavar='OBJECT',
+        help='object made with -c to link into every ROM, may be repeated')
+    parser.add_argument('--base', type=lambda x: int(x, 0), help='link address, the .org of the source by default')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='-v per file, -vv tokens and AST')
+    args = parser.parse_args(argv)
+    if args.optimize and (args.compile or args.library):
+        parser.error('-O works on whole programs, it cannot be used with -c or -l')
+    if args.compile and args.library:
+        parser.error('-l links ROMs, it cannot be used with -c')
+    if args.base is not None and not args.library:
+        parser.error('--base is the link address, it needs -l')
+    args.suffix = args.suffix or ('.o' if args.compile else '.bin')
+
+    libraries = list()
+    linking = ''
+    for path in args.library:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = f.read()
+            libraries.append(ObjectFile.loads(data))
+        except (OSError, UnicodeDecodeError, ValueError, KeyError) as err:
+            print(f"{path}: {err}", file=sys.stderr)
+            return 1
+        linking += '\0' + hashlib.sha256(data.encode('utf-8')).hexdigest()
+    if args.library or args.compile:
+        linking += f"\0{'object' if args.compile else 'link'}\0{args.base}"
+
+    started = time.perf_counter()
+    cache = BuildCache(args.cache)
+    todo = list()
+    skipped = failed = 0
+
+    for path in collect(args.inputs, args.pattern):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                source = f.read()
+        except (OSError, UnicodeDecodeError) as err:
+            print(f"{path}: {err}", file=sys.stderr)
+            failed += 1
+            continue
+
+        content = f"{ASSEMBLER_VERSION}\0{source}" + ("\0optimize" if args.optimize else "") + linking
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        output = output_path(path, args)
+        key = os.path.abspath(path)
+        if not args.force and cache.fresh(key, digest, output):
+            skipped += 1
+            if args.verbose: print(f"{path}: up to date")
+            continue
+        todo.append((key, digest, output, path, source))
+
+    if args.compile:
+        work = compile_item
+        items = [(i, path, source) for i, (_, _, _, path, source) in enumerate(todo)]
+    elif args.library:
+        work = link_item
+        items = [(i, path, source, libraries, args.base) for i, (_, _, _, path, source) in enumerate(todo)]
     else:
-        print(*tokens, sep='\n')
-        print()
-        print(*ast, sep='\n')
-        print()
-        print(*map(hex, code))
+        work = assemble_item
+        items = [(i, path, source, args.optimize) for i, (_, _, _, path, source) in enumerate(todo)]
+    if args.jobs > 1 and len(items) > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        results = executor.map(work, items, chunksize=max(1, len(items) // (args.jobs * 4)))
+    else:
+        executor = None
+        results = map(work, items)
+
+    built = 0
+    for (key, digest, output, path, source), result in zip(todo, results):
+        if args.verbose > 1: dump(path, source)
+        if not result.success:
+            print(result.message, file=sys.stderr)
+            failed += 1
+            continue
+
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'wb') as out:
+            out.write(result.rom)
+        cache.store(key, digest, output)
+        built += 1
+        if args.verbose: print(f"{path} -> {output} ({len(result.rom)} bytes)")
+        if args.verbose and args.optimize: print(f"{path}: {result.message}")
 
-        with open('out.bin', 'wb') as out:
-            out.write(bytes(code))
+    if executor: executor.shutdown()
+    cache.save()
 
-        print('Done!')
+    elapsed = time.perf_counter() - started
+    total = built + skipped + failed
+    rate = total / elapsed if elapsed else 0
+    print(f"{total} sources: {built} built, {skipped} up to date, {failed} failed in {elapsed:.2f}s ({rate:.0f}/s)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,16 @@
 from .mytoken import *
 from .myast import *
 
+# Arguments without a value are the same everywhere, one object each
 ARGS = {
-    (TokenType.KEYWORD, 'K'): ArgType.KEY,
-    (TokenType.KEYWORD, 'DT'): ArgType.DELAY_TIMER,
-    (TokenType.KEYWORD, 'ST'): ArgType.SOUND_TIMER,
-    (TokenType.KEYWORD, 'I'): ArgType.INDEX,
-    (TokenType.KEYWORD, 'B'): ArgType.BCD,
-    (TokenType.KEYWORD, 'F'): ArgType.FLAGS,
+    (TokenType.KEYWORD, 'K'): Argument(ArgType.KEY, NULL),
+    (TokenType.KEYWORD, 'DT'): Argument(ArgType.DELAY_TIMER, NULL),
+    (TokenType.KEYWORD, 'ST'): Argument(ArgType.SOUND_TIMER, NULL),
+    (TokenType.KEYWORD, 'I'): Argument(ArgType.INDEX, NULL),
+    (TokenType.KEYWORD, 'B'): Argument(ArgType.BCD, NULL),
+    (TokenType.KEYWORD, 'F'): Argument(ArgType.FLAGS, NULL),
 }
+INDEX_ADDR = Argument(ArgType.INDEX_ADDR, NULL)
 
 class Parser:
     def __init__(self, tokens):
@@ -21,6 +23,12 @@ class Parser:
     def next(self):
         self.pos += 1
 
+    def peek(self):
+        return self.tokens[self.pos + 1]
+
+    def location(self):
+        return self.tokens.locate(self.curr().pos)
+
     def match(self, t, v=None):
         if self.curr().type != t or (v and v != self.curr().value):
             return False
@@ -30,7 +38,7 @@ class Parser:
     def consume(self, t, v=None):
         if not self.match(t, v):
             message = f"{t} excepted here" if not v else f"{t} '{v}' excepted here"
-            raise ChipSyntaxError(self.curr().location, message)
+            raise ChipSyntaxError(self.location(), message)
     
     def parse(self):
         ast = []
@@ -38,6 +46,10 @@ class Parser:
             ast.append(self.statement())
         return ast
 
+    def statements(self):
+        while self.curr().type != TokenType.EOF:
+            yield self.statement()
+
     def statement(self):
         if self.curr().type == TokenType.IDENTIFITER:
             return self.label()
@@ -45,44 +57,37 @@ class Parser:
             return self.instruction()
         elif self.match(TokenType.SYMBOL, '.'):
             return self.directive()
+        else:
+            raise ChipSyntaxError(self.location(), f"Unexcepted {self.curr()} here")
 
     def label(self):
-        l = Label(self.curr().value, self.curr().location); self.next()
+        l = Label(self.curr().value, self.location()); self.next()
         self.consume(TokenType.SYMBOL, ':')
         return l
 
     def instruction(self):
-        i = Instruction(self.curr().value, self.curr().location); self.next()
-
-        if self.curr().type in [TokenType.MNEMONIC, TokenType.EOF]: return i
-        if self.curr().value == '.': return i
-        if self.tokens[self.pos+1].value == ':': return i
-        
-        i.append(self.argument())
-
-        while self.match(TokenType.SYMBOL, ','):
-            i.append(self.argument())
-
-        return i
+        mnemo, location = self.curr().value, self.location(); self.next()
+        return Instruction(mnemo, location, self.arguments())
 
     def directive(self):
-        i = Directive(self.curr().value, self.curr().location); self.next()
+        name, location = self.curr().value, self.location(); self.next()
+        return Directive(name, location, self.arguments())
 
-        if self.curr().type in [TokenType.MNEMONIC, TokenType.EOF]: return i
-        if self.curr().value == '.': return i
-        if self.tokens[self.pos+1].value == ':': return i
-        
-        i.append(self.argument())
-    
+    def arguments(self):
+        if self.curr().type in [TokenType.MNEMONIC, TokenType.EOF]: return ()
+        if self.curr().value == '.': return ()
+        if self.peek().value == ':': return ()
+
+        args = [self.argument()]
         while self.match(TokenType.SYMBOL, ','):
-            i.append(self.argument())
-    
-        return i
+            args.append(self.argument())
+
+        return tuple(args)
 
     def argument(self):
         if self.match(TokenType.SYMBOL, '['):
             if self.match(TokenType.KEYWORD, 'I'):
-                arg = Argument(ArgType.INDEX_ADDR, NullValue())
+                arg = INDEX_ADDR
             else:
                 arg = Argument(ArgType.ADDRESS, self.value())
             self.consume(TokenType.SYMBOL, ']')
@@ -92,8 +97,7 @@ class Parser:
         elif self.match(TokenType.SYMBOL, '!'):
             arg = Argument(ArgType.NIBBLE, self.value())
         elif (self.curr().type, self.curr().value) in ARGS.keys():
-            a = (self.curr().type, self.curr().value)
-            arg = Argument(ARGS[a], NullValue())
+            arg = ARGS[(self.curr().type, self.curr().value)]
             self.next()
         else:
             arg = Argument(ArgType.BYTE, self.value())
@@ -106,8 +110,41 @@ class Parser:
             self.next()
             return v
         elif self.curr().type == TokenType.NUMBER:
-            v = Number(self.curr().value)
+            v = number(self.curr().value)
             self.next()
             return v
         else:
-            raise ChipSyntaxError(self.curr().location, "Unexcepted end of args")
+            raise ChipSyntaxError(self.location(), "Unexcepted end of args")
+
+
+# Same grammar over a token iterator (see mytoken.scan). Only the current
+# token and one token of lookahead are held, statements are produced one
+# at a time by statements().
+class StreamParser(Parser):
+    def __init__(self, source, tokens):
+        self.source = source
+        self.tokens = iter(tokens)
+        self.count = 0
+        self.current = self.pull()
+        self.ahead = None
+
+    def pull(self):
+        self.count += 1
+        return next(self.tokens)
+
+    def curr(self):
+        return self.current
+
+    def next(self):
+        if self.ahead is not None:
+            self.current, self.ahead = self.ahead, None
+        elif self.current.type != TokenType.EOF:
+            self.current = self.pull()
+
+    def peek(self):
+        if self.ahead is None:
+            self.ahead = self.current if self.current.type == TokenType.EOF else self.pull()
+        return self.ahead
+
+    def location(self):
+        return Location(self.source, self.current.pos)
@@ -1,8 +1,9 @@
+from bisect import bisect_right
 from dataclasses import dataclass
 from enum import Enum
+import re
+import sys
 
-SYMBOLS = set('.,:@[](){}!')
-HEX = set('0123456789abcdef')
 MNEMONICS = {
     'cls', 'ret', 'jp', 'call',
     'se', 'sne', 'ld', 'add',
@@ -24,29 +25,37 @@ class TokenizeError(BaseException):
     def __str__(self):
         return self.__repr__()
 
-@dataclass
+class SourceText:
+    def __init__(self, path, text):
+        self.path = path
+        self.text = text
+        self.line_starts = None
+
+    def position(self, pos):
+        # Line index is only built when some error actually needs it
+        if self.line_starts is None:
+            self.line_starts = [0] + [m.end() for m in re.finditer('\n', self.text)]
+        line = bisect_right(self.line_starts, pos)
+        return line, pos - self.line_starts[line - 1] + 1
+
 class Location:
-    source: str = "repl"
-    pos: int = 0
-    line: int = 1
-    column: int = 1
-
-    def step(self, ch='.'):
-        self.pos += 1
-        if ch == '\n':
-            self.line += 1
-            self.column = 1
-        else:
-            self.column += 1
+    __slots__ = ('source', 'pos')
+
+    def __init__(self, source, pos):
+        self.source = source
+        self.pos = pos
 
-    def next(self, pos):
-        return Location(self.source, pos, self.line, self.column + (pos - self.pos))
+    @property
+    def line(self):
+        return self.source.position(self.pos)[0]
+
+    @property
+    def column(self):
+        return self.source.position(self.pos)[1]
 
-    def copy(self):
-        return Location(self.source, self.pos, self.line, self.column)
-    
     def __repr__(self):
-        return f"{self.source},{self.pos}:{self.line}:{self.column}"
+        line, column = self.source.position(self.pos)
+        return f"{self.source.path},{self.pos}:{line}:{column}"
 
 class TokenType(Enum):
     IDENTIFITER = 1
@@ -60,120 +69,87 @@ class TokenType(Enum):
 
 @dataclass
 class Token:
+    __slots__ = ('type', 'value', 'pos')
     type: TokenType
     value: str
-    location: Location
+    pos: int
 
     def __repr__(self):
         return f"{self.type} <{self.value}>" if self.value else f"{self.type}"
 
-def trim_space(source, start):
-    end = start.copy()
-    for i in range(start.pos, len(source)):
-        if not source[i].isspace(): break
-        end.step(source[end.pos])
-    return None, end
-
-def tokenize_word(source, start):
-    end = start.next(len(source))
-    for i in range(start.pos, len(source)):
-        if (not source[i].isalnum()) and (not source[i] == '_'):
-            end = start.next(i)
-            break
-
-    value = source[start.pos:end.pos]
-    type_ = TokenType.IDENTIFITER
-    
-    if value in MNEMONICS:
-        type_ = TokenType.MNEMONIC
-    elif value in REGS:
-        type_ = TokenType.KEYWORD
-
-    return Token(type_, value, start), end
-
-def tokenize_dec(source, start):
-    end = start.next(len(source))
-    for i in range(start.pos, len(source)):
-        if not source[i].isdigit():
-            end = start.next(i)
-            if source[end.pos].isalpha(): raise TokenizeError(start, "Wrong DEC")
-            break
-    
-    value = int(source[start.pos:end.pos])
-    type_ = TokenType.NUMBER
-
-    return Token(type_, value, start), end
-
-
-def tokenize_hex(source, start):
-    start.step()
-    end = start.next(len(source))
-    for i in range(start.pos, len(source)):
-        if not source[i] in HEX:
-            end = start.next(i)
-            if source[end.pos].isalpha(): raise TokenizeError(start, "Wrong HEX")
-            break
-    
-    value = int(source[start.pos:end.pos], 16)
-    type_ = TokenType.NUMBER
-
-    return Token(type_, value, start), end
-
-def tokenize_bin(source, start):
-    start.step()
-    end = start.next(len(source))
-    for i in range(start.pos, len(source)):
-        if not source[i] in ['0', '1']:
-            end = start.next(i)
-            if source[end.pos].isalnum(): raise TokenizeError(start, "Wrong BIN")
-            break
-    
-    value = int(source[start.pos:end.pos], 2)
-    type_ = TokenType.NUMBER
-
-    return Token(type_, value, start), end
-
-def tokenize_symbol(source, start):
-    token = Token(TokenType.SYMBOL, source[start.pos], start)
-    end = start.copy(); end.step()
-    return token, end
-
-
-def tokenize_comment(source, start):
-    start.step()
-    end = start.next(len(source))
-    for i in range(start.pos, len(source)):
-        if source[i] == '\n':
-            end = start.next(i)
-            break
-    return None, end
+class Tokens(list):
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+
+    def locate(self, pos):
+        return Location(self.source, pos)
+
+# One alternative per token class, tried in a single regex match per token.
+# Whitespace and comments are folded into one skipped run.
+TOKEN_PATTERN = re.compile(r"""
+    (?P<skip>(?:\s+|;[^\n]*)+)
+  | (?P<word>[^\W\d_]\w*)
+  | (?P<dec>\d+)
+  | \#(?P<hex>[0-9a-f]*)
+  | \$(?P<bin>[01]*)
+  | (?P<symbol>[.,:@\[\](){}!])
+""", re.VERBOSE)
+
+# Mnemonics and keywords map to one shared string each, so every token and
+# node holds the same object instead of a fresh copy of the match
+WORDS = {
+    **{word: (TokenType.MNEMONIC, sys.intern(word)) for word in MNEMONICS},
+    **{word: (TokenType.KEYWORD, sys.intern(word)) for word in REGS},
+}
+
+# Tokens one at a time, EOF last. tokenize() collects them into a list,
+# the streaming assembler pulls them as the parser needs them.
+def scan(text):
+    source = text.text
+    match = TOKEN_PATTERN.match
+    length = len(source)
+    pos = 0
+
+    while pos < length:
+        m = match(source, pos)
+        kind = m.lastgroup if m else None
+        end = m.end() if m else pos
+
+        if kind == 'skip':
+            pass
+        elif kind == 'symbol':
+            yield Token(TokenType.SYMBOL, m.group(), pos)
+        elif kind == 'word' and source[pos].isalpha():
+            value = m.group()
+            kind, value = WORDS.get(value) or (TokenType.IDENTIFITER, value)
+            yield Token(kind, value, pos)
+        elif kind == 'dec':
+            if end < length and (source[end].isalpha() or source[end].isdigit()):
+                raise TokenizeError(Location(text, pos), "Wrong DEC")
+            yield Token(TokenType.NUMBER, int(m.group()), pos)
+        elif kind == 'hex':
+            if end < length and source[end].isalpha() or end == pos + 1:
+                raise TokenizeError(Location(text, pos + 1), "Wrong HEX")
+            yield Token(TokenType.NUMBER, int(m.group(kind), 16), pos + 1)
+        elif kind == 'bin':
+            if end < length and source[end].isalnum() or end == pos + 1:
+                raise TokenizeError(Location(text, pos + 1), "Wrong BIN")
+            yield Token(TokenType.NUMBER, int(m.group(kind), 2), pos + 1)
+        elif source[pos].isdigit():
+            # Digits like '²' pass str.isdigit() but can never form a number
+            raise TokenizeError(Location(text, pos), "Wrong DEC")
+        else:
+            raise TokenizeError(Location(text, pos), f"Unknown symbol '{source[pos]}'")
+
+        pos = end
 
+    yield Token(TokenType.EOF, '', pos)
 
 def tokenize(path, source):
-    location = Location(path)
-    tokens = list()
-    token = None
-
-    while True:
-        _, location = trim_space(source, location)
-        if location.pos >= len(source): break
-        
-        if source[location.pos].isalpha():
-            token, location = tokenize_word(source, location)
-        elif source[location.pos].isdigit():
-            token, location = tokenize_dec(source, location)
-        elif source[location.pos] == '#':
-            token, location = tokenize_hex(source, location)
-        elif source[location.pos] in SYMBOLS:
-            token, location = tokenize_symbol(source, location)
-        elif source[location.pos] == ';':
-            token, location = tokenize_comment(source, location)
-        elif source[location.pos] == '$':
-            token, location = tokenize_bin(source, location)
-        
-        if token: tokens.append(token)
-
-    tokens.append(Token(TokenType.EOF, '', location))
+    text = SourceText(path, source)
+    tokens = Tokens(text)
+    tokens.extend(scan(text))
     return tokens
 
 if __name__ == '__main__':
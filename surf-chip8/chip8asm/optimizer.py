@@ -0,0 +1,200 @@
+from dataclasses import dataclass
+
+from .myast import *
+
+# Optional pass over the parsed program, run after calculate() while label
+# references are still symbolic; the caller recalculates addresses after it.
+#
+# Skip instructions skip exactly the next two bytes, so an instruction right
+# after a skip is never removed or merged, and a jp or ret right after a skip
+# is conditional. Programs that jump to literal addresses or use jp @0, [..]
+# depend on their exact layout: only size-preserving rewrites are done there.
+# Self-modifying code is not supported.
+
+MAX_PASSES = 8
+
+SKIPS = {
+    ('se', (ArgType.REG, ArgType.BYTE)), ('sne', (ArgType.REG, ArgType.BYTE)),
+    ('se', (ArgType.REG, ArgType.REG)), ('sne', (ArgType.REG, ArgType.REG)),
+    ('skp', (ArgType.REG,)), ('sknp', (ArgType.REG,)),
+}
+
+JP = ('jp', (ArgType.ADDRESS,))
+JP_V0 = ('jp', (ArgType.REG, ArgType.ADDRESS))
+CALL = ('call', (ArgType.ADDRESS,))
+RET = ('ret', tuple())
+LD_BYTE = ('ld', (ArgType.REG, ArgType.BYTE))
+LD_REG = ('ld', (ArgType.REG, ArgType.REG))
+ADD_BYTE = ('add', (ArgType.REG, ArgType.BYTE))
+
+@dataclass
+class Savings:
+    bytes: int = 0
+    cycles: int = 0
+
+    def __str__(self):
+        return f"Optimizer saved {self.bytes} bytes, {self.cycles} cycles"
+
+def form(statement):
+    if type(statement) != Instruction: return None
+    return (statement.mnemo, tuple(arg.type_ for arg in statement.args))
+
+def make(mnemo, location, *args):
+    return Instruction(mnemo, location, args)
+
+def literal(arg):
+    return arg.value.v if type(arg.value) == Number else None
+
+def target(statement):
+    value = statement.args[-1].value
+    return value.name if type(value) == Identifier else None
+
+def fixed_layout(ast):
+    for statement in ast:
+        f = form(statement)
+        if f == JP_V0: return True
+        if f and ArgType.ADDRESS in f[1] and target(statement) is None: return True
+    return False
+
+# Code that would report an error must stay, or removing it hides the error
+def valid(statement, env):
+    if form(statement) not in INSTRUCTION_SET: return False
+    return all(arg.value.name in env.c for arg in statement.args if type(arg.value) == Identifier)
+
+def protected(out):
+    for statement in reversed(out):
+        if type(statement) != Label:
+            return form(statement) in SKIPS
+    return False
+
+def thread_jumps(ast, savings):
+    labels = {statement.name: i for i, statement in enumerate(ast) if type(statement) == Label}
+
+    def landing(name):
+        i = labels.get(name)
+        if i is None: return None
+        while i < len(ast) and type(ast[i]) == Label: i += 1
+        return ast[i] if i < len(ast) and type(ast[i]) == Instruction else None
+
+    out = list()
+    for statement in ast:
+        f = form(statement)
+        if f in (JP, CALL) and target(statement) is not None:
+            name, seen, hops = target(statement), {target(statement)}, 0
+            while True:
+                landed = landing(name)
+                if form(landed) != JP or target(landed) is None or target(landed) in seen: break
+                name = target(landed)
+                seen.add(name)
+                hops += 1
+
+            if f == JP and form(landing(name)) == RET:
+                statement = make('ret', statement.location)
+                hops += 1
+            elif hops:
+                statement = make(statement.mnemo, statement.location, Argument(ArgType.ADDRESS, Identifier(name)))
+            savings.cycles += hops
+        out.append(statement)
+    return out
+
+def remove_dead_code(ast, env, savings):
+    out = list()
+    unreachable = False
+    for i, statement in enumerate(ast):
+        if type(statement) != Instruction:
+            unreachable = False
+        elif unreachable:
+            if valid(statement, env):
+                savings.bytes += statement.size
+                continue
+        elif form(statement) == JP and not protected(out):
+            # Jump to the next instruction
+            following = list()
+            for s in ast[i + 1:]:
+                if type(s) != Label: break
+                following.append(s.name)
+            if target(statement) in following:
+                savings.bytes += statement.size
+                savings.cycles += 1
+                continue
+            unreachable = True
+        elif form(statement) == RET and not protected(out):
+            unreachable = True
+        else:
+            unreachable = False
+        out.append(statement)
+    return out
+
+def register(arg):
+    return literal(arg) if arg.type_ == ArgType.REG else None
+
+def peephole(ast, env, savings):
+    out = list()
+    for statement in ast:
+        f = form(statement)
+        if f is None or protected(out) or not valid(statement, env):
+            out.append(statement)
+            continue
+
+        args = statement.args
+        x = register(args[0]) if args else None
+
+        # ld @x, @x and add @x, 0 do nothing
+        if f == LD_REG and x is not None and x == register(args[1]) \
+                or f == ADD_BYTE and x is not None and literal(args[1]) == 0:
+            savings.bytes += statement.size
+            savings.cycles += 1
+            continue
+
+        prev = out[-1] if out else None
+        pf = form(prev)
+        if pf not in (LD_BYTE, LD_REG, ADD_BYTE) or f not in (LD_BYTE, LD_REG, ADD_BYTE) \
+                or x is None or register(prev.args[0]) != x or protected(out[:-1]) or not valid(prev, env):
+            out.append(statement)
+            continue
+
+        a = literal(prev.args[1])
+        b = literal(statement.args[1])
+        y = register(prev.args[1]) if pf == LD_REG else None
+        z = register(args[1]) if f == LD_REG else None
+
+        if pf == LD_BYTE and f == ADD_BYTE and a is not None and b is not None:
+            out[-1] = make('ld', prev.location, prev.args[0], Argument(ArgType.BYTE, number((a + b) & 0xff)))
+        elif pf == ADD_BYTE and f == ADD_BYTE and a is not None and b is not None:
+            out[-1] = make('add', prev.location, prev.args[0], Argument(ArgType.BYTE, number((a + b) & 0xff)))
+        elif pf in (LD_BYTE, LD_REG) and y != x and (f == LD_BYTE or f == LD_REG and z is not None and z != x):
+            # The first load is overwritten before anything reads it
+            out[-1] = statement
+        else:
+            out.append(statement)
+            continue
+        savings.bytes += statement.size
+        savings.cycles += 1
+    return out
+
+def reverse_move(ast, savings):
+    out = list()
+    for statement in ast:
+        prev = out[-1] if out else None
+        if form(statement) == LD_REG and form(prev) == LD_REG and not protected(out[:-1]):
+            x, y = register(prev.args[0]), register(prev.args[1])
+            if x is not None and (register(statement.args[0]), register(statement.args[1])) == (y, x):
+                # ld @x, @y then ld @y, @x: both already hold the same value
+                savings.bytes += statement.size
+                savings.cycles += 1
+                continue
+        out.append(statement)
+    return out
+
+def optimize(ast, env):
+    savings = Savings()
+    fixed = fixed_layout(ast)
+    for _ in range(MAX_PASSES):
+        before = (savings.bytes, savings.cycles)
+        ast = thread_jumps(ast, savings)
+        if not fixed:
+            ast = remove_dead_code(ast, env, savings)
+            ast = peephole(ast, env, savings)
+            ast = reverse_move(ast, savings)
+        if (savings.bytes, savings.cycles) == before: break
+    return ast, savings
@@ -0,0 +1,106 @@
+from .mytoken import SourceText, scan
+from .myast import *
+from .myparser import StreamParser
+from .mymain import Env
+from time import perf_counter
+
+# One-pass assembler. Statements come straight from the token stream and
+# are encoded as soon as they are parsed, with the labels defined so far.
+# A label that is not defined yet is encoded as zero and recorded as a
+# fixup: the bit field it goes to, patched once the whole source was read.
+# Only the output, the labels and the fixups stay in memory.
+#
+# Labels may be defined twice, the last definition wins like in the three
+# pass assembler: fields that used the earlier value are patched again.
+# Errors are raised in source order, so when a source has several the first
+# one may differ from the three pass path: assemble() then reports the
+# three pass error instead. An undefined label is reported at the statement
+# that uses it first.
+
+# form -> {arg index: (mask, shift)}, the same fields ENCODERS fill in
+FIELDS = {form: {i: (mask, shift) for i, mask, shift in operand_fields(form[1])} for form in INSTRUCTION_SET}
+
+class Known:
+    # Label values for encoding a statement, unknown ones are zero for now
+    def __init__(self, env):
+        self.c = env.c
+
+    def get(self, name):
+        return self.c.get(name, 0)
+
+# (offset, width, label, mask, shift) of every label used by a statement.
+# The three pass assembler resolves every label even when its value is not
+# encoded anywhere, those get an empty mask so undefined ones still fail.
+def references(statement):
+    if type(statement) == Instruction:
+        fields = FIELDS.get((statement.mnemo, tuple(arg.type_ for arg in statement.args)), {})
+        for i, arg in enumerate(statement.args):
+            if type(arg.value) == Identifier:
+                yield (0, 2, arg.value.name, *fields.get(i, (0, 0)))
+    else:
+        for i, arg in enumerate(statement.args):
+            if type(arg.value) == Identifier:
+                yield (i, 1, arg.value.name, 0xff if arg.type_ == ArgType.BYTE else 0, 0)
+
+def patch(code, pos, width, mask, shift, value):
+    field = mask << shift
+    if width == 2:
+        word = (code[pos] << 8 | code[pos + 1]) & ~field | (value & mask) << shift
+        code[pos] = word >> 8
+        code[pos + 1] = word & 0xff
+    else:
+        code[pos] = code[pos] & ~field & 0xff | (value & mask) << shift
+
+class StreamResult:
+    def __init__(self, code, tokens, statements, fixups, seconds):
+        self.code = code
+        self.tokens = tokens
+        self.statements = statements
+        self.fixups = fixups
+        self.seconds = seconds # phase -> time spent in it
+
+def assemble_stream(path, source):
+    text = SourceText(path, source)
+    parser = StreamParser(text, scan(text))
+    env = Env()
+    known = Known(env)
+    code = bytearray()
+    fixups = list() # (pos, width, label, mask, shift, location)
+    uses = dict()   # label -> [(pos, width, mask, shift)] encoded with its current value
+    statements = 0
+    # Tokenizing and parsing happen inside the loop header, encoding in its
+    # body: both are timed per statement
+    parsing = encoding = 0.0
+    now = perf_counter()
+
+    for statement in parser.statements():
+        parsed = perf_counter()
+        parsing += parsed - now
+        statements += 1
+        if type(statement) == Label and statement.name in env.c:
+            for pos, width, mask, shift in uses.pop(statement.name, ()):
+                fixups.append((pos, width, statement.name, mask, shift, statement.location))
+        statement.calculate(env)
+
+        size = statement.size
+        if size:
+            pos = len(code)
+            code.extend(bytes(size))
+            statement.emit(known, code, pos)
+
+            for offset, width, name, mask, shift in references(statement):
+                if name in env.c:
+                    uses.setdefault(name, list()).append((pos + offset, width, mask, shift))
+                else:
+                    fixups.append((pos + offset, width, name, mask, shift, statement.location))
+        now = perf_counter()
+        encoding += now - parsed
+
+    start = perf_counter()
+    parsing += start - now
+    for pos, width, name, mask, shift, location in fixups:
+        if name not in env.c:
+            raise ChipSyntaxError(location, f"Unknown {Identifier(name)}")
+        patch(code, pos, width, mask, shift, env.c[name])
+    seconds = {'parse': parsing, 'encode': encoding, 'fixup': perf_counter() - start}
+    return StreamResult(code, parser.count, statements, len(fixups), seconds)
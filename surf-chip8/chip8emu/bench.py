@@ -0,0 +1,47 @@
+import os
+import timeit
+
+from .machine import Machine, decode
+
+STATIC = os.path.join(os.path.dirname(__file__), '..', 'static', 'chip8')
+
+# Counter, ALU, sprite and skip heavy loop, never halts
+LOOP = bytes.fromhex(
+    '6000'  # 200: ld v0, 0
+    '6101'  # 202: ld v1, 1
+    '8014'  # 204: add v0, v1
+    '8203'  # 206: xor v2, v0
+    'f029'  # 208: ld F, v0
+    'd015'  # 20a: drw v0, v1, 5
+    '3000'  # 20c: se v0, 0
+    '7301'  # 20e: add v3, 1
+    'c40f'  # 210: rnd v4, 0f
+    '1204'  # 212: jp 204
+)
+
+class Uncached(Machine):
+    def step(self):
+        pc = self.pc & 0xfff
+        op = decode(self.memory[pc] << 8 | self.memory[(pc + 1) & 0xfff], self.quirks)
+        self.pc = (pc + 2) & 0xfff
+        op(self)
+
+def bench(name, rom, machine=Machine, cycles=200000, repeat=3):
+    best = min(timeit.repeat(lambda: machine(rom).run(cycles=cycles), number=1, repeat=repeat))
+    print(f"{name:<24} {cycles / best:12,.0f} cycles/s")
+    return best
+
+def bench_lockstep(name, rom, count=1000, frames=60):
+    from .lockstep import Lockstep
+    seeds = list(range(count))
+    best = min(timeit.repeat(lambda: Lockstep([rom] * count, seeds=seeds).run(frames), number=1, repeat=3))
+    per_rom = min(timeit.repeat(lambda: Machine(rom).run(frames=frames), number=1, repeat=3))
+    print(f"{name:<24} {count} ROMs in {best:.2f}s, {per_rom * count:.2f}s one by one")
+    return best
+
+if __name__ == '__main__':
+    bench('loop', LOOP)
+    bench('loop (decode per cycle)', LOOP, machine=Uncached)
+    with open(os.path.join(STATIC, 'morse_demo.ch8'), 'rb') as f:
+        bench('morse_demo', f.read())
+    bench_lockstep('loop (lockstep)', LOOP)
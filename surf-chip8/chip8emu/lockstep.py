@@ -0,0 +1,245 @@
+import hashlib
+import random
+
+import numpy as np
+
+from .machine import FONT, HEIGHT, MEMORY_SIZE, PROGRAM_START, WIDTH, EmulatorError, Quirks
+
+# Many machines stepped together, one row of every array per machine.
+# Every cycle the fetched opcodes are classified through KIND and each
+# class present runs once as array operations over its machines. Semantics
+# match machine.Machine exactly, including the rnd sequence for a seed.
+
+(CLS, RET, JP, CALL, SE_KK, SNE_KK, SE_XY, LD_KK, ADD_KK, LD_XY, OR, AND, XOR,
+ ADD_XY, SUB, SHR, SUBN, SHL, SNE_XY, LD_I, JP_V0, RND, DRW, SKP, SKNP, LD_X_DT,
+ LD_X_K, LD_DT, LD_ST, ADD_I, LD_F, LD_B, STORE, LOAD, UNKNOWN) = range(35)
+
+def opcode_kinds():
+    op = np.arange(0x10000, dtype=np.int32)
+    group, n, kk = op >> 12, op & 0xf, op & 0xff
+    kind = np.full(0x10000, UNKNOWN, dtype=np.uint8)
+    kind[op == 0x00e0] = CLS
+    kind[op == 0x00ee] = RET
+    for g, k in [(0x1, JP), (0x2, CALL), (0x3, SE_KK), (0x4, SNE_KK), (0x6, LD_KK),
+                 (0x7, ADD_KK), (0xa, LD_I), (0xb, JP_V0), (0xc, RND), (0xd, DRW)]:
+        kind[group == g] = k
+    kind[(group == 0x5) & (n == 0)] = SE_XY
+    kind[(group == 0x9) & (n == 0)] = SNE_XY
+    for m, k in [(0x0, LD_XY), (0x1, OR), (0x2, AND), (0x3, XOR), (0x4, ADD_XY),
+                 (0x5, SUB), (0x6, SHR), (0x7, SUBN), (0xe, SHL)]:
+        kind[(group == 0x8) & (n == m)] = k
+    for g, b, k in [(0xe, 0x9e, SKP), (0xe, 0xa1, SKNP), (0xf, 0x07, LD_X_DT), (0xf, 0x0a, LD_X_K),
+                    (0xf, 0x15, LD_DT), (0xf, 0x18, LD_ST), (0xf, 0x1e, ADD_I), (0xf, 0x29, LD_F),
+                    (0xf, 0x33, LD_B), (0xf, 0x55, STORE), (0xf, 0x65, LOAD)]:
+        kind[(group == g) & (kk == b)] = k
+    return kind
+
+KIND = opcode_kinds()
+
+class Lockstep:
+    def __init__(self, roms, seeds=None, keys=None, quirks=None, cycles_per_frame=10, font=FONT):
+        count = len(roms)
+        self.memory = np.zeros((count, MEMORY_SIZE), dtype=np.uint8)
+        self.memory[:, :len(font)] = np.frombuffer(font, dtype=np.uint8)
+        self.active = np.ones(count, dtype=bool)
+        self.errors = [None] * count
+        for m, rom in enumerate(roms):
+            if len(rom) > MEMORY_SIZE - PROGRAM_START:
+                self.errors[m] = str(EmulatorError(PROGRAM_START, "ROM does not fit in memory"))
+                self.active[m] = False
+                continue
+            self.memory[m, PROGRAM_START:PROGRAM_START + len(rom)] = np.frombuffer(rom, dtype=np.uint8)
+
+        self.v = np.zeros((count, 16), dtype=np.int32)
+        self.i = np.zeros(count, dtype=np.int32)
+        self.pc = np.full(count, PROGRAM_START, dtype=np.int32)
+        self.stack = np.zeros((count, 16), dtype=np.int32)
+        self.sp = np.zeros(count, dtype=np.int32)
+        self.dt = np.zeros(count, dtype=np.int32)
+        self.st = np.zeros(count, dtype=np.int32)
+        self.display = np.zeros((count, HEIGHT), dtype=np.uint64)
+
+        self.seeds = [0] * count if seeds is None else seeds
+        self.random = dict() # Created on the first rnd of a machine
+        self.script = {frame: sum(1 << k for k in pressed) for frame, pressed in (keys or {}).items()}
+        self.keys = self.script.get(0, 0)
+        self.quirks = quirks or Quirks()
+        self.cycles_per_frame = cycles_per_frame
+        self.frames = 0
+
+    def fail(self, s, message):
+        for m in s:
+            self.errors[m] = str(EmulatorError(int(self.pc[m]) - 2, message))
+        self.active[s] = False
+        self.pc[s] -= 2
+
+    def rng(self, m):
+        generator = self.random.get(m)
+        if generator is None:
+            generator = self.random[m] = random.Random(self.seeds[m])
+        return generator
+
+    def store(self, s, offset, values):
+        self.memory[s, (self.i[s] + offset) & 0xfff] = values
+
+    def step(self):
+        s = np.flatnonzero(self.active)
+        if len(s) == 0: return
+        pc = self.pc[s] & 0xfff
+        opcode = (self.memory[s, pc].astype(np.int32) << 8) | self.memory[s, (pc + 1) & 0xfff]
+        self.pc[s] = (pc + 2) & 0xfff
+
+        kinds = KIND[opcode]
+        for kind in np.unique(kinds):
+            mask = kinds == kind
+            self.execute(kind, s[mask], opcode[mask])
+
+    def execute(self, kind, s, op):
+        x, y, n, kk, nnn = (op >> 8) & 0xf, (op >> 4) & 0xf, op & 0xf, op & 0xff, op & 0xfff
+        v = self.v
+
+        if kind == CLS:
+            self.display[s] = 0
+        elif kind == RET:
+            empty = self.sp[s] == 0
+            self.fail(s[empty], "Return with empty stack")
+            s = s[~empty]
+            self.sp[s] -= 1
+            self.pc[s] = self.stack[s, self.sp[s]]
+        elif kind == JP:
+            self.pc[s] = nnn
+        elif kind == CALL:
+            full = self.sp[s] >= 16
+            self.fail(s[full], "Stack overflow")
+            s, nnn = s[~full], nnn[~full]
+            self.stack[s, self.sp[s]] = self.pc[s]
+            self.sp[s] += 1
+            self.pc[s] = nnn
+        elif kind == SE_KK:
+            self.pc[s] += 2 * (v[s, x] == kk)
+        elif kind == SNE_KK:
+            self.pc[s] += 2 * (v[s, x] != kk)
+        elif kind == SE_XY:
+            self.pc[s] += 2 * (v[s, x] == v[s, y])
+        elif kind == SNE_XY:
+            self.pc[s] += 2 * (v[s, x] != v[s, y])
+        elif kind == LD_KK:
+            v[s, x] = kk
+        elif kind == ADD_KK:
+            v[s, x] = (v[s, x] + kk) & 0xff
+        elif kind == LD_XY:
+            v[s, x] = v[s, y]
+        elif kind == OR:
+            v[s, x] = v[s, x] | v[s, y]
+        elif kind == AND:
+            v[s, x] = v[s, x] & v[s, y]
+        elif kind == XOR:
+            v[s, x] = v[s, x] ^ v[s, y]
+        elif kind == ADD_XY:
+            total = v[s, x] + v[s, y]
+            v[s, x] = total & 0xff
+            v[s, 0xf] = total >> 8
+        elif kind == SUB:
+            vx, vy = v[s, x], v[s, y]
+            v[s, x] = (vx - vy) & 0xff
+            v[s, 0xf] = vx >= vy
+        elif kind == SUBN:
+            vx, vy = v[s, x], v[s, y]
+            v[s, x] = (vy - vx) & 0xff
+            v[s, 0xf] = vy >= vx
+        elif kind == SHR:
+            src = v[s, y] if self.quirks.shift_vy else v[s, x]
+            v[s, x] = src >> 1
+            v[s, 0xf] = src & 1
+        elif kind == SHL:
+            src = v[s, y] if self.quirks.shift_vy else v[s, x]
+            v[s, x] = (src << 1) & 0xff
+            v[s, 0xf] = src >> 7
+        elif kind == LD_I:
+            self.i[s] = nnn
+        elif kind == JP_V0:
+            self.pc[s] = (nnn + v[s, 0]) & 0xfff
+        elif kind == RND:
+            # Per machine generators keep results identical to Machine
+            bits = np.array([self.rng(m).getrandbits(8) for m in s], dtype=np.int32)
+            v[s, x] = bits & kk
+        elif kind == DRW:
+            self.draw(s, v[s, x] % WIDTH, v[s, y] % HEIGHT, n)
+        elif kind == SKP or kind == SKNP:
+            pressed = (v[s, x] < 16) & (((self.keys >> np.minimum(v[s, x], 15)) & 1) == 1)
+            self.pc[s] += 2 * (pressed if kind == SKP else ~pressed)
+        elif kind == LD_X_DT:
+            v[s, x] = self.dt[s]
+        elif kind == LD_X_K:
+            if self.keys:
+                v[s, x] = (self.keys & -self.keys).bit_length() - 1
+            else:
+                self.pc[s] -= 2
+        elif kind == LD_DT:
+            self.dt[s] = v[s, x]
+        elif kind == LD_ST:
+            self.st[s] = v[s, x]
+        elif kind == ADD_I:
+            self.i[s] = (self.i[s] + v[s, x]) & 0xfff
+        elif kind == LD_F:
+            self.i[s] = (v[s, x] & 0xf) * 5
+        elif kind == LD_B:
+            value = v[s, x]
+            self.store(s, 0, value // 100)
+            self.store(s, 1, value // 10 % 10)
+            self.store(s, 2, value % 10)
+        elif kind == STORE:
+            for r in range(16):
+                some = x >= r
+                if not some.any(): break
+                self.store(s[some], r, v[s[some], r])
+            if self.quirks.load_store_increment: self.i[s] = (self.i[s] + x + 1) & 0xfff
+        elif kind == LOAD:
+            for r in range(16):
+                some = x >= r
+                if not some.any(): break
+                t = s[some]
+                v[t, r] = self.memory[t, (self.i[t] + r) & 0xfff]
+            if self.quirks.load_store_increment: self.i[s] = (self.i[s] + x + 1) & 0xfff
+        else:
+            for m, code in zip(s, op):
+                self.fail([m], f"Unknown opcode {int(code):04x}")
+
+    def draw(self, s, x, y, n):
+        collision = np.zeros(len(s), dtype=bool)
+        shift = (WIDTH - 8 - x).astype(np.int64)
+        for row in range(int(n.max(initial=0))):
+            some = (row < n) & (y + row < HEIGHT)
+            if not some.any(): continue
+            t, r = s[some], y[some] + row
+            sprite = self.memory[t, (self.i[t] + row) & 0xfff].astype(np.uint64)
+            left = shift[some]
+            # Sprite bits past the right edge are clipped, like Machine.draw
+            bits = np.where(left >= 0, sprite << np.maximum(left, 0).astype(np.uint64),
+                                       sprite >> np.maximum(-left, 0).astype(np.uint64))
+            collision[some] |= (self.display[t, r] & bits) != 0
+            self.display[t, r] ^= bits
+        self.v[s, 0xf] = collision
+
+    def frame(self):
+        for _ in range(self.cycles_per_frame):
+            self.step()
+        self.frames += 1
+        live = self.active
+        self.dt[live] = np.maximum(self.dt[live] - 1, 0)
+        self.st[live] = np.maximum(self.st[live] - 1, 0)
+        if self.frames in self.script:
+            self.keys = self.script[self.frames]
+
+    def run(self, frames):
+        for _ in range(frames):
+            self.frame()
+        return self
+
+    def display_hashes(self):
+        rows = self.display.astype('>u8')
+        return [hashlib.sha256(rows[m].tobytes()).hexdigest() for m in range(len(rows))]
+
+def run_corpus(roms, frames, **kwargs):
+    machines = Lockstep(roms, **kwargs).run(frames)
+    return list(zip(machines.display_hashes(), machines.errors))
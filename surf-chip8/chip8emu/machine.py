@@ -0,0 +1,236 @@
+import hashlib
+import random
+
+WIDTH = 64
+HEIGHT = 32
+PROGRAM_START = 0x200
+MEMORY_SIZE = 0x1000
+ROW_MASK = (1 << WIDTH) - 1
+
+FONT = bytes([
+    0xf0, 0x90, 0x90, 0x90, 0xf0, 0x20, 0x60, 0x20, 0x20, 0x70,
+    0xf0, 0x10, 0xf0, 0x80, 0xf0, 0xf0, 0x10, 0xf0, 0x10, 0xf0,
+    0x90, 0x90, 0xf0, 0x10, 0x10, 0xf0, 0x80, 0xf0, 0x10, 0xf0,
+    0xf0, 0x80, 0xf0, 0x90, 0xf0, 0xf0, 0x10, 0x20, 0x40, 0x40,
+    0xf0, 0x90, 0xf0, 0x90, 0xf0, 0xf0, 0x90, 0xf0, 0x10, 0xf0,
+    0xf0, 0x90, 0xf0, 0x90, 0x90, 0xe0, 0x90, 0xe0, 0x90, 0xe0,
+    0xf0, 0x80, 0x80, 0x80, 0xf0, 0xe0, 0x90, 0x90, 0x90, 0xe0,
+    0xf0, 0x80, 0xf0, 0x80, 0xf0, 0xf0, 0x80, 0xf0, 0x80, 0x80,
+])
+
+class EmulatorError(BaseException):
+    def __init__(self, pc, message):
+        super().__init__(self)
+        self.pc = pc
+        self.message = message
+
+    def __repr__(self):
+        return f"{self.pc:#05x} Emulator error: {self.message}"
+
+    def __str__(self):
+        return self.__repr__()
+
+# Every handler is decoded once per address: operands are pulled out of the
+# opcode here and captured by the closure, step() only calls it.
+
+def decode(opcode, quirks):
+    x = (opcode >> 8) & 0xf
+    y = (opcode >> 4) & 0xf
+    n = opcode & 0xf
+    kk = opcode & 0xff
+    nnn = opcode & 0xfff
+    group = opcode >> 12
+
+    if opcode == 0x00e0:
+        def op(m): m.display[:] = [0] * HEIGHT
+    elif opcode == 0x00ee:
+        def op(m):
+            if not m.stack: raise EmulatorError(m.pc - 2, "Return with empty stack")
+            m.pc = m.stack.pop()
+    elif group == 0x1:
+        def op(m): m.pc = nnn
+    elif group == 0x2:
+        def op(m):
+            if len(m.stack) >= 16: raise EmulatorError(m.pc - 2, "Stack overflow")
+            m.stack.append(m.pc)
+            m.pc = nnn
+    elif group == 0x3:
+        def op(m):
+            if m.v[x] == kk: m.pc += 2
+    elif group == 0x4:
+        def op(m):
+            if m.v[x] != kk: m.pc += 2
+    elif group == 0x5 and n == 0:
+        def op(m):
+            if m.v[x] == m.v[y]: m.pc += 2
+    elif group == 0x6:
+        def op(m): m.v[x] = kk
+    elif group == 0x7:
+        def op(m): m.v[x] = (m.v[x] + kk) & 0xff
+    elif group == 0x8 and n == 0x0:
+        def op(m): m.v[x] = m.v[y]
+    elif group == 0x8 and n == 0x1:
+        def op(m): m.v[x] |= m.v[y]
+    elif group == 0x8 and n == 0x2:
+        def op(m): m.v[x] &= m.v[y]
+    elif group == 0x8 and n == 0x3:
+        def op(m): m.v[x] ^= m.v[y]
+    elif group == 0x8 and n == 0x4:
+        def op(m):
+            s = m.v[x] + m.v[y]
+            m.v[x] = s & 0xff
+            m.v[0xf] = s >> 8
+    elif group == 0x8 and n == 0x5:
+        def op(m):
+            flag = int(m.v[x] >= m.v[y])
+            m.v[x] = (m.v[x] - m.v[y]) & 0xff
+            m.v[0xf] = flag
+    elif group == 0x8 and n == 0x6:
+        src = y if quirks.shift_vy else x
+        def op(m):
+            flag = m.v[src] & 1
+            m.v[x] = m.v[src] >> 1
+            m.v[0xf] = flag
+    elif group == 0x8 and n == 0x7:
+        def op(m):
+            flag = int(m.v[y] >= m.v[x])
+            m.v[x] = (m.v[y] - m.v[x]) & 0xff
+            m.v[0xf] = flag
+    elif group == 0x8 and n == 0xe:
+        src = y if quirks.shift_vy else x
+        def op(m):
+            flag = m.v[src] >> 7
+            m.v[x] = (m.v[src] << 1) & 0xff
+            m.v[0xf] = flag
+    elif group == 0x9 and n == 0:
+        def op(m):
+            if m.v[x] != m.v[y]: m.pc += 2
+    elif group == 0xa:
+        def op(m): m.i = nnn
+    elif group == 0xb:
+        def op(m): m.pc = (nnn + m.v[0]) & 0xfff
+    elif group == 0xc:
+        def op(m): m.v[x] = m.random.getrandbits(8) & kk
+    elif group == 0xd:
+        def op(m): m.draw(m.v[x], m.v[y], n)
+    elif group == 0xe and kk == 0x9e:
+        def op(m):
+            if m.v[x] in m.keys: m.pc += 2
+    elif group == 0xe and kk == 0xa1:
+        def op(m):
+            if m.v[x] not in m.keys: m.pc += 2
+    elif group == 0xf and kk == 0x07:
+        def op(m): m.v[x] = m.dt
+    elif group == 0xf and kk == 0x0a:
+        def op(m):
+            if not m.keys:
+                m.pc -= 2
+            else:
+                m.v[x] = min(m.keys)
+    elif group == 0xf and kk == 0x15:
+        def op(m): m.dt = m.v[x]
+    elif group == 0xf and kk == 0x18:
+        def op(m): m.st = m.v[x]
+    elif group == 0xf and kk == 0x1e:
+        def op(m): m.i = (m.i + m.v[x]) & 0xfff
+    elif group == 0xf and kk == 0x29:
+        def op(m): m.i = (m.v[x] & 0xf) * 5
+    elif group == 0xf and kk == 0x33:
+        def op(m):
+            value = m.v[x]
+            m.store(m.i, (value // 100, value // 10 % 10, value % 10))
+    elif group == 0xf and kk == 0x55:
+        def op(m):
+            m.store(m.i, m.v[:x + 1])
+            if quirks.load_store_increment: m.i = (m.i + x + 1) & 0xfff
+    elif group == 0xf and kk == 0x65:
+        def op(m):
+            for r in range(x + 1):
+                m.v[r] = m.memory[(m.i + r) & 0xfff]
+            if quirks.load_store_increment: m.i = (m.i + x + 1) & 0xfff
+    else:
+        def op(m): raise EmulatorError(m.pc - 2, f"Unknown opcode {opcode:04x}")
+
+    return op
+
+class Quirks:
+    def __init__(self, shift_vy=False, load_store_increment=False):
+        self.shift_vy = shift_vy
+        self.load_store_increment = load_store_increment
+
+class Machine:
+    def __init__(self, rom, seed=0, keys=None, quirks=None, cycles_per_frame=10, font=FONT):
+        if len(rom) > MEMORY_SIZE - PROGRAM_START:
+            raise EmulatorError(PROGRAM_START, "ROM does not fit in memory")
+
+        self.memory = bytearray(MEMORY_SIZE)
+        self.memory[:len(font)] = font
+        self.memory[PROGRAM_START:PROGRAM_START + len(rom)] = rom
+        self.v = [0] * 16
+        self.i = 0
+        self.pc = PROGRAM_START
+        self.stack = list()
+        self.dt = 0
+        self.st = 0
+        self.display = [0] * HEIGHT # One int per row, bit 63 is the left pixel
+        self.random = random.Random(seed)
+        self.script = dict(keys or {})
+        self.keys = set(self.script.get(0, ()))
+        self.quirks = quirks or Quirks()
+        self.cycles_per_frame = cycles_per_frame
+        self.cycles = 0
+        self.frames = 0
+        self.cache = [None] * MEMORY_SIZE
+
+    def store(self, address, values):
+        for offset, value in enumerate(values):
+            a = (address + offset) & 0xfff
+            self.memory[a] = value
+            # Both instructions overlapping this byte are decoded again
+            self.cache[a] = None
+            self.cache[a - 1] = None
+
+    def draw(self, x, y, n):
+        x %= WIDTH
+        y %= HEIGHT
+        collision = 0
+        for row in range(min(n, HEIGHT - y)):
+            bits = ((self.memory[(self.i + row) & 0xfff] << (WIDTH - 8)) >> x) & ROW_MASK
+            collision |= self.display[y + row] & bits
+            self.display[y + row] ^= bits
+        self.v[0xf] = int(collision != 0)
+
+    def step(self):
+        pc = self.pc & 0xfff
+        op = self.cache[pc]
+        if op is None:
+            opcode = self.memory[pc] << 8 | self.memory[(pc + 1) & 0xfff]
+            op = self.cache[pc] = decode(opcode, self.quirks)
+        self.pc = (pc + 2) & 0xfff
+        op(self)
+
+    def frame(self):
+        for _ in range(self.cycles_per_frame):
+            self.step()
+        self.cycles += self.cycles_per_frame
+        self.frames += 1
+        if self.dt: self.dt -= 1
+        if self.st: self.st -= 1
+        if self.frames in self.script:
+            self.keys = set(self.script[self.frames])
+
+    def run(self, frames=None, cycles=None):
+        if cycles is not None:
+            for _ in range(cycles):
+                self.step()
+            self.cycles += cycles
+        for _ in range(frames or 0):
+            self.frame()
+        return self
+
+    def screen(self):
+        return [[(row >> (WIDTH - 1 - x)) & 1 for x in range(WIDTH)] for row in self.display]
+
+    def display_hash(self):
+        data = b''.join(row.to_bytes(WIDTH // 8, 'big') for row in self.display)
+        return hashlib.sha256(data).hexdigest()
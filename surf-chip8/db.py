@@ -1,14 +1,68 @@
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy import text
 from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
 from flask import current_app, g
+from flask.cli import with_appcontext
 from .model import *
 import click
+import os
+import threading
 
-engine = create_engine("sqlite:///database.db", echo=False)
+# Applied to every new SQLite connection. WAL lets readers go on while a
+# writer commits, NORMAL only syncs at checkpoints (safe with WAL).
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+def set_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+    return on_connect
+
+# SQLite lower() and LIKE only fold ASCII, search compares unicode_lower()
+def unicode_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+def register_sqlite_functions(dbapi_connection, connection_record):
+    dbapi_connection.create_function('unicode_lower', 1, unicode_lower, deterministic=True)
+
+def create_db_engine(url, options=None, pragmas=None):
+    engine = create_engine(url, **(options or {}))
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', set_sqlite_pragmas({**SQLITE_PRAGMAS, **(pragmas or {})}))
+        event.listen(engine, 'connect', register_sqlite_functions)
+    return engine
+
+_engine_lock = threading.Lock()
+
+def get_engine():
+    state = current_app.extensions['db']
+    with _engine_lock:
+        # Concurrent first requests would each build an engine and a pool
+        if state['engine'] is None:
+            config = current_app.config
+            state['engine'] = create_db_engine(config['DATABASE_URL'],
+                config['DATABASE_ENGINE_OPTIONS'], config['SQLITE_PRAGMAS'])
+            state['pid'] = os.getpid()
+        elif state['pid'] != os.getpid():
+            # Forked after the pool was used: leave the parent's connections
+            # alone and open new ones in this process
+            state['engine'].dispose(close=False)
+            state['pid'] = os.getpid()
+        return state['engine']
 
 def get_db_session():
     if 'db_session' not in g:
-        g.db_session = Session(engine)
+        g.db_session = Session(get_engine())
     return g.db_session
 
 def close_db_session(e=None):
@@ -16,14 +70,46 @@ def close_db_session(e=None):
     if db_session is not None:
         db_session.close()
 
+# create_all() does not touch tables that already exist either: columns
+# added to the model since are added here, empty (see `flask snippets rebuild`).
+# Rows already in the table get the server default, so a NOT NULL column
+# added to the model needs a server_default or the ALTER fails
+def add_missing_columns(engine):
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    # Quoted: "user" is a reserved word in PostgreSQL
+                    definition = CreateColumn(column).compile(dialect=engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}"))
+
 def init_db():
+    engine = get_engine()
     Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    # create_all() skips indexes of tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            for statement in SEARCH_INDEX + REINDEX_SEARCH:
+                connection.execute(text(statement))
 
 @click.command('init-db')
+@with_appcontext
 def init_db_command():
     init_db()
     click.echo('Initialized the database.')
 
 def init_app(app):
+    app.config.setdefault('DATABASE_URL', 'sqlite:///database.db')
+    app.config.setdefault('DATABASE_ENGINE_OPTIONS', {})
+    app.config.setdefault('SQLITE_PRAGMAS', {})
+    # The engine is created on first use, in the process that uses it
+    app.extensions['db'] = {'engine': None, 'pid': None}
     app.teardown_appcontext(close_db_session)
     app.cli.add_command(init_db_command)
@@ -0,0 +1,33 @@
+from flask import Response
+from flask import g
+from flask import request
+from time import perf_counter
+
+from .chip8asm.metrics import Histogram, render
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency per route.',
+                            ['endpoint', 'method', 'status'])
+
+def start_timer():
+    g.request_started = perf_counter()
+
+def record(status):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(perf_counter() - started, request.endpoint or 'unknown', request.method, status)
+
+def record_response(response):
+    record(response.status_code)
+    return response
+
+def record_failure(exc=None):
+    if exc is not None: record(500) # after_request does not run then
+
+def metrics():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    app.before_request(start_timer)
+    app.after_request(record_response)
+    app.teardown_request(record_failure)
+    app.add_url_rule('/metrics', 'metrics', metrics)
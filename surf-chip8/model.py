@@ -1,14 +1,19 @@
 from typing import List
+from typing import Optional
 from sqlalchemy import ForeignKey
+from sqlalchemy import LargeBinary
 from sqlalchemy import String
+from sqlalchemy import Text
 from sqlalchemy import UniqueConstraint
+from sqlalchemy import column
+from sqlalchemy import false
+from sqlalchemy import table
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import relationship
 
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
+import hashlib
 
 class Base(DeclarativeBase):
     pass
@@ -21,12 +26,10 @@ class User(Base):
     password: Mapped[str] = mapped_column(String(500), nullable=False)
     snippets: Mapped[List["Snippet"]] = relationship(back_populates="author")
     
-    def __init__(self, username, password):
+    # Hashes come from passwords.hash_password(), hashing is not done here
+    def __init__(self, username, password_hash):
         self.name = username
-        self.password = generate_password_hash(password)
-    
-    def check_password(self, password):
-        return check_password_hash(self.password, password)
+        self.password = password_hash
     
     def __repr__(self):
         return f"User #{self.id} {name}"
@@ -36,26 +39,97 @@ class Snippet(Base):
     
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50), nullable=False, unique=True)
-    source: Mapped[str] = mapped_column(String(5000), nullable=False)
+    source: Mapped[str] = mapped_column(Text, nullable=False)
 
-    author_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
+    author_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False, index=True)
     author: Mapped["User"] = relationship(back_populates="snippets")
+
+    rom: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    diagnostics: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    source_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    assembler_version: Mapped[Optional[int]] = mapped_column(nullable=True)
+    # Server default so init-db can add it to tables that already have rows
+    optimize: Mapped[bool] = mapped_column(nullable=False, default=False, server_default=false())
+
+    revisions: Mapped[List["SnippetRevision"]] = relationship(back_populates="snippet",
+        cascade="all, delete-orphan", order_by="SnippetRevision.number")
     
-    def __init__(self, author, name, source):
+    def __init__(self, author, name, source, optimize=False):
         self.name = name
         self.source = source
         self.author = author
+        self.optimize = optimize
+
+    def digest(self):
+        # Name is hashed too: it is the source path in assembler diagnostics.
+        # So is the optimize flag, it changes the build
+        content = f"{self.name}\0{self.source}" + ("\0optimize" if self.optimize else "")
+        content = content.encode('utf-8')
+        return hashlib.sha256(content).hexdigest()
+
+    def is_built(self, version):
+        return self.source_hash == self.digest() and self.assembler_version == version
     
     def __repr__(self):
         return f"Snippet #{self.id} '{self.name}' by {self.author.name}: '{self.source[:15]}...'"
 
 
+class SnippetRevision(Base):
+    __tablename__ = 'snippet_revision'
+    __table_args__ = (UniqueConstraint('snippet_id', 'number'),)
 
+    id: Mapped[int] = mapped_column(primary_key=True)
+    snippet_id: Mapped[int] = mapped_column(ForeignKey("snippet.id", ondelete="CASCADE"), nullable=False)
+    snippet: Mapped["Snippet"] = relationship(back_populates="revisions")
+    number: Mapped[int] = mapped_column(nullable=False)
+    snapshot: Mapped[bool] = mapped_column(nullable=False)
+    size: Mapped[int] = mapped_column(nullable=False)
+
+    # Full source or delta, zlib-compressed (see revisions.py)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False, deferred=True)
+
+    def __init__(self, snippet, number, snapshot, data, size):
+        self.snippet = snippet
+        self.number = number
+        self.snapshot = snapshot
+        self.data = data
+        self.size = size
 
-
-
-
-
-
-
-
+    def __repr__(self):
+        kind = 'snapshot' if self.snapshot else 'delta'
+        return f"Revision #{self.number} of snippet #{self.snippet_id} ({kind}, {self.size} chars)"
+
+
+# Full-text index over snippet name, author name and source. The trigram
+# tokenizer matches any substring of 3+ characters. Rows share the snippet
+# id and are kept in sync by triggers, so the ORM never writes to it.
+snippet_search = table('snippet_search', column('rowid'), column('name'), column('author'), column('source'))
+
+SEARCH_INDEX = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS snippet_search
+       USING fts5(name, author, source, tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS snippet_search_insert AFTER INSERT ON snippet BEGIN
+         INSERT INTO snippet_search(rowid, name, author, source)
+         VALUES (new.id, new.name, (SELECT name FROM "user" WHERE id = new.author_id), new.source);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS snippet_search_update AFTER UPDATE OF name, source, author_id ON snippet BEGIN
+         DELETE FROM snippet_search WHERE rowid = old.id;
+         INSERT INTO snippet_search(rowid, name, author, source)
+         VALUES (new.id, new.name, (SELECT name FROM "user" WHERE id = new.author_id), new.source);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS snippet_search_delete AFTER DELETE ON snippet BEGIN
+         DELETE FROM snippet_search WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS snippet_search_author AFTER UPDATE OF name ON "user" BEGIN
+         UPDATE snippet_search SET author = new.name
+         WHERE rowid IN (SELECT id FROM snippet WHERE author_id = new.id);
+       END""",
+]
+
+# Refills the index from scratch, for databases created before it existed
+REINDEX_SEARCH = [
+    "DELETE FROM snippet_search",
+    """INSERT INTO snippet_search(rowid, name, author, source)
+       SELECT snippet.id, snippet.name, "user".name, snippet.source
+       FROM snippet JOIN "user" ON "user".id = snippet.author_id""",
+]
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+from werkzeug.security import check_password_hash
+from werkzeug.security import generate_password_hash
+import os
+import threading
+
+# Password hashing runs on a small thread pool (hashlib releases the GIL
+# while hashing), so at most PASSWORD_HASH_WORKERS hashes use the CPU at
+# once. Up to PASSWORD_HASH_QUEUE more may wait for a worker, anything
+# beyond that is refused with HashingBusy instead of piling up.
+
+class HashingBusy(Exception):
+    pass
+
+_pool_lock = threading.Lock()
+
+def get_pool():
+    state = current_app.extensions['passwords']
+    with _pool_lock:
+        # Threads do not survive a fork, workers build their own pool
+        if state['pid'] != os.getpid():
+            workers = current_app.config['PASSWORD_HASH_WORKERS']
+            state['executor'] = ThreadPoolExecutor(workers, thread_name_prefix='password-hash') if workers else None
+            state['slots'] = threading.BoundedSemaphore(workers + current_app.config['PASSWORD_HASH_QUEUE'])
+            state['pid'] = os.getpid()
+        return state
+
+def run(function, *args):
+    state = get_pool()
+    if state['executor'] is None:
+        return function(*args)
+
+    if not state['slots'].acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        future = state['executor'].submit(function, *args)
+    except:
+        state['slots'].release()
+        raise
+    future.add_done_callback(lambda future: state['slots'].release())
+    return future.result()
+
+# Method string as Werkzeug writes it into the hash, defaults filled in
+def normalize_method(method):
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{int(iterations)}"
+    elif name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    return method
+
+def hash_password(password):
+    return run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+def check_password(password_hash, password):
+    return run(check_password_hash, password_hash, password)
+
+def needs_rehash(password_hash):
+    method = password_hash.split('$', 1)[0]
+    return method != normalize_method(current_app.config['PASSWORD_HASH_METHOD'])
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}')
+    app.config.setdefault('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))
+    app.config.setdefault('PASSWORD_HASH_QUEUE', 16)
+    app.extensions['passwords'] = {'executor': None, 'slots': None, 'pid': None}
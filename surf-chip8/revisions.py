@@ -0,0 +1,88 @@
+from difflib import SequenceMatcher
+from sqlalchemy import func
+from sqlalchemy import select
+from .model import SnippetRevision
+import json
+import zlib
+
+# Every save of a snippet source is kept as a revision. Most revisions are
+# zlib-compressed line deltas against the previous one, every
+# SNAPSHOT_INTERVAL-th is the full source, so rebuilding any revision
+# decodes at most SNAPSHOT_INTERVAL rows. snippet.source keeps the current
+# source, the history is only read when a revision is requested.
+
+SNAPSHOT_INTERVAL = 16
+
+def compress(data):
+    return zlib.compress(data.encode('utf-8'), 9)
+
+def decompress(data):
+    return zlib.decompress(data).decode('utf-8')
+
+# Delta is a list of [start, end] line ranges copied from the old source
+# and strings inserted as they are
+def make_delta(old, new):
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    delta = list()
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j1 != j2:
+            delta.append(''.join(b[j1:j2]))
+    return json.dumps(delta, ensure_ascii=False, separators=(',', ':'))
+
+def apply_delta(old, delta):
+    a = old.splitlines(keepends=True)
+    return ''.join(''.join(a[op[0]:op[1]]) if isinstance(op, list) else op for op in json.loads(delta))
+
+def latest_number(dbs, snippet_id):
+    return dbs.scalar(select(func.max(SnippetRevision.number)).where(SnippetRevision.snippet_id == snippet_id))
+
+def add_revision(dbs, snippet, previous, source):
+    last = latest_number(dbs, snippet.id) if snippet.id is not None else None
+    if last is None and previous is not None and previous != source:
+        # Snippet saved before revisions existed, its old source comes first
+        dbs.add(SnippetRevision(snippet, 1, True, compress(previous), len(previous)))
+        last = 1
+
+    if last is not None and previous == source:
+        return None
+    number = (last or 0) + 1
+    data = compress(source)
+    if (number - 1) % SNAPSHOT_INTERVAL != 0:
+        delta = compress(make_delta(previous, source))
+        if len(delta) < len(data):
+            revision = SnippetRevision(snippet, number, False, delta, len(source))
+            dbs.add(revision)
+            return revision
+    revision = SnippetRevision(snippet, number, True, data, len(source))
+    dbs.add(revision)
+    return revision
+
+def list_revisions(dbs, snippet_id):
+    query = select(SnippetRevision.number, SnippetRevision.snapshot, SnippetRevision.size)\
+        .where(SnippetRevision.snippet_id == snippet_id)\
+        .order_by(SnippetRevision.number)
+    return dbs.execute(query).all()
+
+# Source of one revision from the closest snapshot at or before it
+def load_revision(dbs, snippet_id, number):
+    base = dbs.scalar(select(func.max(SnippetRevision.number)).where(
+        SnippetRevision.snippet_id == snippet_id,
+        SnippetRevision.snapshot.is_(True),
+        SnippetRevision.number <= number))
+    if base is None:
+        return None
+
+    query = select(SnippetRevision.number, SnippetRevision.data)\
+        .where(SnippetRevision.snippet_id == snippet_id, SnippetRevision.number.between(base, number))\
+        .order_by(SnippetRevision.number)
+    rows = dbs.execute(query).all()
+    if rows[-1].number != number:
+        return None
+
+    source = decompress(rows[0].data)
+    for row in rows[1:]:
+        source = apply_delta(source, decompress(row.data))
+    return source
@@ -8,44 +8,116 @@ from flask import Response
 from flask import request
 from flask import session
 from flask import url_for
+from sqlalchemy import func
 from sqlalchemy import select
+from sqlalchemy.orm import load_only, selectinload
 from sqlalchemy.exc import IntegrityError, OperationalError
 from .db import get_db_session
 from .model import *
+from . import revisions
 import functools
 from .auth import login_required
+from .chip8asm.assembler import assemble, ASSEMBLER_VERSION
+from .chip8asm.incremental import IncrementalAssembler
+from .chip8asm.batch import assemble_batch, zip_results
+from flask import current_app
+from werkzeug.utils import secure_filename
+import click
+from collections import OrderedDict
+import threading
+import base64
 import json
+import io
+import os
+import secrets
 
 bp = Blueprint('snippets', __name__, url_prefix='/snippets')
 
+# Editor sessions for incremental assembly, least recently used dropped first
+EDITOR_SESSIONS_LIMIT = 128
+editor_sessions = OrderedDict()
+editor_sessions_lock = threading.Lock()
+
+# Largest incremental request body, a full source included
+EDITOR_REQUEST_LIMIT = 256 * 1024
+
+BATCH_LIMIT = 1000
+
+# Largest ROM that fits between #200 and the end of memory
+ROM_LIMIT = 0x1000 - 0x200
+
+SEARCH_COLUMNS = {'name': Snippet.name, 'author': User.name, 'source': Snippet.source}
+
+# Substring search through the trigram index, '^' and '$' anchor the match
+# to the start and end of the field like they did in the old regexp search.
+# Databases other than SQLite have no snippet_search and use plain ILIKE.
+def search_condition(search_by, expression, fts=True):
+    field = snippet_search.c[search_by] if fts else SEARCH_COLUMNS[search_by]
+    anchor_start = expression.startswith('^')
+    core = expression[1:] if anchor_start else expression
+    anchor_end = core.endswith('$')
+    core = core[:-1] if anchor_end else core
+
+    escaped = core.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = ('' if anchor_start else '%') + escaped + ('' if anchor_end else '%')
+    if not fts:
+        return field.ilike(pattern, escape='\\')
+    # MATCH folds case for any alphabet, LIKE only for ASCII: both sides go
+    # through unicode_lower() (see db.py) where LIKE is still needed
+    condition = func.unicode_lower(field).like(pattern.lower(), escape='\\')
+    if len(core) >= 3:
+        # Trigrams need at least 3 characters, shorter queries scan the index
+        match = field.op('MATCH')('"' + core.replace('"', '""') + '"')
+        condition = match & condition if anchor_start or anchor_end else match
+    return condition
+
+PAGE_SIZE = 50
+
 @bp.route('/')
 def snippets_list():
     dbs = get_db_session()
 
     expression = request.args.get('expression')
     search_by = request.args.get('search-by')
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+
+    # Only what the list shows: no source or ROM, authors in one extra query
+    query = select(Snippet).options(
+        load_only(Snippet.id, Snippet.name, Snippet.author_id),
+        selectinload(Snippet.author).load_only(User.id, User.name))
+    if expression and search_by in SEARCH_COLUMNS and dbs.bind.dialect.name == 'sqlite':
+        query = query\
+            .join(snippet_search, snippet_search.c.rowid == Snippet.id)\
+            .where(search_condition(search_by, expression))
+    elif expression and search_by in SEARCH_COLUMNS:
+        query = query\
+            .join(User, Snippet.author_id == User.id)\
+            .where(search_condition(search_by, expression, fts=False))
+
+    # Keyset pagination on the id, a page costs the same wherever it is
+    if before is not None:
+        query = query.where(Snippet.id < before).order_by(Snippet.id.desc())
+    else:
+        query = query.where(Snippet.id > (after or 0)).order_by(Snippet.id)
 
     try:
-        if (not expression) or (not search_by):
-            snippets = dbs.scalars(select(Snippet)).all()
-        elif search_by == 'name':
-            snippets = dbs.query(Snippet)\
-                .where(Snippet.name.op('regexp')(expression))\
-                .all()
-        elif search_by == 'author':
-            snippets = dbs.query(Snippet)\
-                .join(User)\
-                .where(User.name.op('regexp')(expression))\
-                .all()
-        elif search_by == 'source':
-            snippets = dbs.query(Snippet)\
-                .where(Snippet.source.op('regexp')(expresson))\
-                .all()
+        snippets = dbs.scalars(query.limit(PAGE_SIZE + 1)).all()
     except OperationalError:
         flash("Ошибка в строке поиска")
         return redirect(url_for('index'))
 
-    return render_template('snippets/list.html', snippets=snippets)
+    more = len(snippets) > PAGE_SIZE
+    snippets = snippets[:PAGE_SIZE]
+    if before is not None:
+        snippets.reverse()
+    has_prev = more if before is not None else after is not None
+    has_next = more if before is None else True
+
+    search = {key: request.args[key] for key in ('expression', 'search-by') if key in request.args}
+    return render_template('snippets/list.html', snippets=snippets,
+        prev_url=url_for('snippets.snippets_list', before=snippets[0].id, **search) if snippets and has_prev else None,
+        next_url=url_for('snippets.snippets_list', after=snippets[-1].id, **search) if snippets and has_next else None)
 
 
 def send_response(message, status, **kwargs):
@@ -55,6 +127,27 @@ def send_response(message, status, **kwargs):
     return Response(json.dumps(content), status=status, mimetype='application/json')
 
 
+def build_snippet(snippet):
+    success, data, message = assemble(snippet)
+    snippet.rom = data.getvalue() if success else None
+    snippet.diagnostics = message
+    snippet.source_hash = snippet.digest()
+    snippet.assembler_version = ASSEMBLER_VERSION
+
+
+def get_build(dbs, snippet):
+    if snippet.is_built(ASSEMBLER_VERSION):
+        return snippet.rom is not None, snippet.rom, snippet.diagnostics
+
+    build_snippet(snippet)
+    build = snippet.rom is not None, snippet.rom, snippet.diagnostics
+    try:
+        dbs.commit()
+    except (IntegrityError, OperationalError):
+        dbs.rollback() # Stored build stays stale, the next read retries
+    return build
+
+
 @bp.route('/<int:id>', methods=['GET', 'PUT', 'DELETE'])
 def snippet(id):
     dbs = get_db_session()
@@ -64,7 +157,7 @@ def snippet(id):
         if not snippet:
             flash("Сниппет не найден")
             return redirect(url_for("index"))
-        if not g.user or snippet.author != g.user:
+        if not g.user or snippet.author_id != g.user.id:
             return render_template('snippets/view.html', snippet=snippet)
         return render_template('snippets/edit.html', snippet=snippet)
 
@@ -80,8 +173,12 @@ def snippet(id):
         if not name or not source:
             return send_response('Не заполнено имя либо код', 400)
         
+        revisions.add_revision(dbs, snippet, snippet.source, source)
         snippet.name = name
         snippet.source = source
+        if 'optimize' in request.json:
+            snippet.optimize = bool(request.json['optimize'])
+        build_snippet(snippet)
         
         try:
             dbs.add(snippet)
@@ -104,19 +201,207 @@ def snippet(id):
 
 
 
+@bp.route('/<int:id>/revisions')
+def snippet_revisions(id):
+    dbs = get_db_session()
+    if dbs.scalar(select(Snippet.id).where(Snippet.id == id)) is None:
+        return send_response('Сниппет не найден', 404)
+    rows = revisions.list_revisions(dbs, id)
+    return send_response('', 200, revisions=[
+        {"number": row.number, "snapshot": row.snapshot, "size": row.size} for row in rows])
+
+
+@bp.route('/<int:id>/revisions/<int:number>')
+def snippet_revision(id, number):
+    dbs = get_db_session()
+    source = revisions.load_revision(dbs, id, number)
+    if source is None: return send_response('Версия не найдена', 404)
+    return send_response('', 200, number=number, source=source)
+
+
+# Same source and assembler give the same build, so the validator is known
+# before anything is assembled. JSON and binary differ in bytes, not in build.
+def build_etag(snippet, binary):
+    return f"{snippet.digest()[:32]}-{ASSEMBLER_VERSION}-{'bin' if binary else 'json'}"
+
+
+def revalidated(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @bp.route('/<int:id>/assemble')
 def assemble_snippet(id):
     dbs = get_db_session()
-    snippet = dbs.query(Snippet).get(id)
+    # The ROM and diagnostics are only read when the client has no fresh copy
+    snippet = dbs.query(Snippet).options(load_only(Snippet.id, Snippet.name, Snippet.source,
+        Snippet.optimize, Snippet.source_hash, Snippet.assembler_version)).get(id)
     if not snippet: return send_response('Сниппет не найден', 404)
+
+    binary = request.args.get('binary') == "1"
+    etag = build_etag(snippet, binary)
+    if request.if_none_match.contains(etag):
+        return revalidated(Response(status=304), etag)
     
-    from .chip8asm.assembler import assemble
-    success, data, message = assemble(snippet)
+    success, rom, message = get_build(dbs, snippet)
     
     if success == False: return send_response(message, 500)
-    if request.args.get('binary') != "1": return send_response(message, 200)
+    if not binary: return revalidated(send_response(message, 200), etag)
     
-    return send_file(data, download_name='program.ch8', mimetype='application/octet-stream')
+    return revalidated(send_file(io.BytesIO(rom), download_name='program.ch8',
+        mimetype='application/octet-stream', etag=False), etag)
+
+
+def get_editor_session(id):
+    # Anonymous editors get their own state through a random id in the cookie
+    client = session.get('user_id')
+    if client is None:
+        client = session.setdefault('editor_id', secrets.token_hex(16))
+    key = (client, id)
+    with editor_sessions_lock:
+        if key in editor_sessions:
+            editor_sessions.move_to_end(key)
+        else:
+            editor_sessions[key] = (threading.Lock(), IncrementalAssembler())
+            if len(editor_sessions) > EDITOR_SESSIONS_LIMIT:
+                editor_sessions.popitem(last=False)
+        return editor_sessions[key]
+
+
+@bp.route('/<int:id>/assemble/incremental', methods=['POST'])
+def assemble_incremental(id):
+    if request.content_length is None or request.content_length > EDITOR_REQUEST_LIMIT:
+        return send_response(f'Запрос больше {EDITOR_REQUEST_LIMIT // 1024} КБ', 413)
+
+    dbs = get_db_session()
+    snippet = dbs.query(Snippet).get(id)
+    if not snippet: return send_response('Сниппет не найден', 404)
+
+    name = request.json.get('name') or snippet.name
+    edit = request.json.get('edit')
+    lock, assembler = get_editor_session(id)
+
+    with lock:
+        if edit is not None:
+            if request.json.get('base') != assembler.revision:
+                return send_response('Правка устарела, нужен полный код', 409, revision=assembler.revision)
+            try:
+                source = assembler.apply(int(edit['start']), int(edit['end']), str(edit['text']))
+            except (KeyError, TypeError, ValueError):
+                return send_response('Неверная правка', 400)
+        else:
+            source = request.json.get('source', snippet.source)
+
+        success, data, message = assembler.assemble(name, source)
+        revision = assembler.revision
+
+    return send_response(message, 200 if success else 500, revision=revision)
+
+
+def result_json(result):
+    content = {
+        "index": result.index,
+        "name": result.name,
+        "success": result.success,
+        "message": result.message,
+        "rom": base64.b64encode(result.rom).decode('ascii') if result.success else None
+    }
+    return json.dumps(content) + '\n'
+
+
+@bp.route('/assemble/batch', methods=['POST'])
+@login_required
+def assemble_snippets_batch():
+    dbs = get_db_session()
+
+    sources = request.json.get('sources') or []
+    ids = request.json.get('ids') or []
+    if len(sources) + len(ids) > BATCH_LIMIT:
+        return send_response(f'Не больше {BATCH_LIMIT} исходников за раз', 400)
+
+    try:
+        items = [(str(item['name']), str(item['source']), bool(item.get('optimize'))) for item in sources]
+        if ids:
+            query = select(Snippet.id, Snippet.name, Snippet.source, Snippet.optimize).where(Snippet.id.in_([int(i) for i in ids]))
+            found = {row.id: (row.name, row.source, row.optimize) for row in dbs.execute(query)}
+            items += [found[int(i)] for i in ids if int(i) in found]
+    except (KeyError, TypeError, ValueError):
+        return send_response('Неверный формат запроса', 400)
+
+    results = assemble_batch(items, jobs=current_app.config.get('ASSEMBLER_JOBS'))
+
+    if request.args.get('format') == 'zip':
+        return Response(zip_results(results, secure_filename), mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=programs.zip'})
+    return Response(map(result_json, results), mimetype='application/x-ndjson')
+
+
+@bp.cli.command('rebuild')
+@click.option('--jobs', type=int, default=None, help='Worker processes, all cores by default.')
+@click.option('--all', 'rebuild_all', is_flag=True, help='Rebuild up to date snippets too.')
+def rebuild_snippets_command(jobs, rebuild_all):
+    dbs = get_db_session()
+    snippets = [s for s in dbs.scalars(select(Snippet)) if rebuild_all or not s.is_built(ASSEMBLER_VERSION)]
+    results = assemble_batch(((s.name, s.source, s.optimize) for s in snippets), jobs=jobs)
+
+    failed = 0
+    for snippet, result in zip(snippets, results):
+        snippet.rom = result.rom
+        snippet.diagnostics = result.message
+        snippet.source_hash = snippet.digest()
+        snippet.assembler_version = ASSEMBLER_VERSION
+        failed += not result.success
+    dbs.commit()
+    click.echo(f'Rebuilt {len(snippets)} snippets, {failed} failed.')
+
+
+@bp.cli.command('smoke')
+@click.option('--frames', type=int, default=600, help='Frames to run every ROM for.')
+@click.option('--seed', type=int, default=0, help='Random seed for the rnd instruction.')
+@click.option('--lockstep', is_flag=True, help='Run all ROMs together on the NumPy engine.')
+@click.option('--save', type=click.Path(dir_okay=False), help='Write display hashes to a JSON file.')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help='Report hashes that differ from a saved JSON file.')
+def smoke_snippets_command(frames, seed, lockstep, save, compare):
+    from .chip8emu.machine import Machine, EmulatorError
+
+    dbs = get_db_session()
+    snippets = dbs.scalars(select(Snippet).where(Snippet.rom.is_not(None))).all()
+
+    if lockstep:
+        from .chip8emu.lockstep import run_corpus
+        results = run_corpus([snippet.rom for snippet in snippets], frames, seeds=[seed] * len(snippets))
+    else:
+        results = list()
+        for snippet in snippets:
+            try:
+                machine = Machine(snippet.rom, seed=seed).run(frames=frames)
+            except EmulatorError as err:
+                results.append((None, str(err)))
+            else:
+                results.append((machine.display_hash(), None))
+
+    failed = 0
+    hashes = dict()
+    for snippet, (digest, error) in zip(snippets, results):
+        if error is not None:
+            failed += 1
+            click.echo(f'#{snippet.id} {snippet.name}: {error}')
+        else:
+            hashes[str(snippet.id)] = digest
+            click.echo(f'#{snippet.id} {snippet.name}: ok {digest[:16]}')
+    click.echo(f'{failed} snippets failed.')
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump(hashes, f, indent=1)
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+        changed = [id for id in baseline if hashes.get(id) != baseline[id]]
+        for id in changed:
+            click.echo(f'#{id}: display changed')
+        click.echo(f'{len(changed)} snippets changed.')
 
 
 @bp.route('/<int:id>/run')
@@ -124,7 +409,11 @@ def run_snippet(id):
     dbs = get_db_session()
     snippet = dbs.query(Snippet).get(id)
     if not snippet: return send_response('Сниппет не найден', 404)
-    return render_template('snippets/run.html', snippet=snippet)
+
+    # Built once here, the page boots the emulator from the inlined ROM
+    success, rom, message = get_build(dbs, snippet)
+    return render_template('snippets/run.html', snippet=snippet, message=message,
+        rom=base64.b64encode(rom).decode('ascii') if success else None)
 
 
     
@@ -139,7 +428,10 @@ def create_new_snippet():
         if not name or not source:
             return send_response('Не заполнено название или код', 400)
         
-        snippet = Snippet(name=name, source=source, author = g.user)
+        author = dbs.get(User, g.user.id) if g.user else None
+        snippet = Snippet(name=name, source=source, author = author, optimize=bool(request.json.get('optimize')))
+        build_snippet(snippet)
+        revisions.add_revision(dbs, snippet, None, source)
         
         try:
             dbs.add(snippet)
@@ -151,3 +443,38 @@ def create_new_snippet():
         
     else:
         return render_template('snippets/edit.html', snippet=None)
+
+
+@bp.route('/import', methods=['POST'])
+@login_required
+def import_rom():
+    from .chip8asm.disassembler import disassemble
+
+    dbs = get_db_session()
+    rom = request.files.get('rom')
+    if rom is None:
+        return send_response('Не передан файл ROM', 400)
+
+    data = rom.read(ROM_LIMIT + 1)
+    if not data or len(data) > ROM_LIMIT:
+        return send_response(f'ROM должен быть размером от 1 до {ROM_LIMIT} байт', 400)
+
+    # secure_filename() would drop non-ASCII names, the name only needs to fit
+    name = request.form.get('name') or os.path.splitext(os.path.basename(rom.filename or ''))[0].strip()[:50]
+    if not name:
+        return send_response('Не заполнено название', 400)
+
+    # Disassembly assembles back to the same bytes, the ROM is not stored as is
+    source = disassemble(data)
+    snippet = Snippet(name=name, source=source, author=dbs.get(User, g.user.id))
+    build_snippet(snippet)
+    revisions.add_revision(dbs, snippet, None, source)
+
+    try:
+        dbs.add(snippet)
+        dbs.commit()
+    except IntegrityError as err:
+        dbs.rollback()
+        return send_response("Сниппет с данным названием уже существует", 400)
+
+    return send_response("ROM дизассемблирован, сниппет создан", 201, new_id=snippet.id)
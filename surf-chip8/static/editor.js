@@ -7,7 +7,8 @@ function toast(header, message) {
 function getData() {
     return {
         "name": $('input[name="name"]')[0].value,
-        "source": $('textarea[name="source"]')[0].value
+        "source": $('textarea[name="source"]')[0].value,
+        "optimize": $('input[name="optimize"]')[0].checked
     }
 };
 
@@ -74,3 +75,58 @@ function getLineAndColumn(textarea){
     var currentColumn = textLines[textLines.length-1].length;
     $('#location')[0].innerText = `${textarea.selectionStart}:${currentLine}:${currentColumn+1}`;
 }
+
+var $BUILD = { "revision": undefined, "source": undefined, "timer": undefined };
+
+function sendIncremental(body) {
+    return fetch(`/snippets/${$SNIPPET_ID}/assemble/incremental`, {
+        "method": "POST",
+        "headers": { "Content-Type": "application/json" },
+        "body": JSON.stringify(body)
+    })
+    .then( response => response.json().then( json => [response.status, json] ) );
+}
+
+function validateSource() {
+    var data = getData();
+    var body = { "name": data.name, "source": data.source };
+    var old = $BUILD.source;
+
+    if ($BUILD.revision !== undefined && old !== undefined) {
+        // Send only the changed span: common prefix and suffix are kept.
+        // Offsets count code points like Python strings, not UTF-16 units.
+        var before = Array.from(old);
+        var after = Array.from(data.source);
+        var start = 0;
+        while (start < before.length && start < after.length && before[start] === after[start]) start++;
+        var end = 0;
+        while (end < before.length - start && end < after.length - start &&
+               before[before.length - 1 - end] === after[after.length - 1 - end]) end++;
+        body = {
+            "name": data.name,
+            "base": $BUILD.revision,
+            "edit": { "start": start, "end": before.length - end, "text": after.slice(start, after.length - end).join('') }
+        };
+    }
+
+    sendIncremental(body)
+    .then( ([status, response]) => {
+        if (status === 409) {
+            $BUILD.revision = undefined;
+            return validateSource();
+        }
+        if (status === 413) {
+            $('#diagnostics')[0].innerText = response.message;
+            return;
+        }
+        $BUILD.revision = response.revision;
+        $BUILD.source = data.source;
+        $('#diagnostics')[0].innerText = response.message;
+    });
+}
+
+$('textarea#source:enabled').bind('input', function() {
+    if (!$SNIPPET_ID) return;
+    clearTimeout($BUILD.timer);
+    $BUILD.timer = setTimeout(validateSource, 300);
+});